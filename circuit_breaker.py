@@ -0,0 +1,63 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Fail fast once a dependency keeps failing.
+
+    After fail_max consecutive failures the breaker opens and callers skip
+    the dependency for reset_timeout seconds. After that it is half-open:
+    exactly one call is let through as a trial while the rest keep failing
+    fast. Success closes the breaker, failure reopens it. A trial that never
+    reports back is replaced by a new one after another reset_timeout.
+    """
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    @property
+    def is_closed(self) -> bool:
+        """Whether calls go through normally. Unlike allow(), never starts a half-open trial."""
+        return self.opened_at is None
+
+    def allow(self) -> bool:
+        """Return whether a call may go through right now."""
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        if self.trial_started_at is not None and now - self.trial_started_at < self.reset_timeout:
+            # A trial call is already in flight
+            return False
+        self.trial_started_at = now
+        return True
+
+    def check(self):
+        """Raise CircuitOpenError if calls are currently blocked."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable, retry in a few seconds")
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None:
+            # The trial failed, or a call from before the breaker opened did; stay open
+            self.opened_at = time.monotonic()
+            self.trial_started_at = None
+        elif self.failures >= self.fail_max:
+            logger.warning(f"{self.name} failed {self.failures} times in a row, opening circuit breaker")
+            self.opened_at = time.monotonic()
@@ -1,15 +1,581 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Callable, Awaitable, TypeVar, AsyncIterator, FrozenSet, Tuple, Type
 import os
-from openai import OpenAI
-import requests
-from models import MealPlan, WorkoutPlan, NutritionGoals
-from functools import lru_cache
+import re
+import json
+import time
+import asyncio
+import random
+import hashlib
+import logging
+from collections import OrderedDict, defaultdict
+from itertools import repeat
+from string import Template
+from openai import AsyncOpenAI, APIError, APIConnectionError, APIStatusError, APITimeoutError, InternalServerError
+import httpx
+import orjson
+import numpy as np
+from pydantic import BaseModel
+from models import MealPlan, WorkoutPlan, NutritionGoals, FullPlan, MealInput, MEAL_PLAN_DAY, WORKOUT_PLAN_DAY
+from semantic_cache import SemanticCache
+from nutrient_store import NutrientStore
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from rate_limiter import AsyncRateLimiter
+from plan_stream import stream_plan_ndjson
+
+logger = logging.getLogger(__name__)
+
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=60,
+    max_retries=2
+)
+# Shared like the client: once the API keeps failing, stop queueing requests behind 60s timeouts
+openai_breaker = CircuitBreaker("AI model", fail_max=5, reset_timeout=30)
+# Keeps concurrent plan generation (full plans, bulk fallbacks) under the account's RPM limit.
+# Each gunicorn worker has its own limiter, so the budget is split between them.
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+openai_limiter = AsyncRateLimiter(
+    max(1, int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500)) // WORKER_COUNT), period=60
+)
+
+T = TypeVar("T")
+M = TypeVar("M", bound=BaseModel)
+
+CHAT_MODEL = "gpt-4o-mini"  # Faster and cheaper than gpt-3.5-turbo, with JSON mode and prompt caching
+CHAT_SEED = 42
+CHAT_CACHE_TTL = 7 * 86400  # Completions are deterministic, keep them for a week
+MEAL_PLAN_MAX_TOKENS = 4000
+WORKOUT_PLAN_MAX_TOKENS = 2000
+
+# OpenAI Batch API, used for bulk jobs that can wait for results at half the token price
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 30  # seconds between status checks
+BATCH_TIMEOUT = 3600  # seconds to wait before falling back to regular completions
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Profiles per multi-plan completion; each plan needs up to MEAL_PLAN_MAX_TOKENS of output
+MULTI_PLAN_GROUP_SIZE = 3
+# Output streams at roughly 100 tokens/s, so a full plan can take about 40s to write
+MULTI_PLAN_SECONDS_PER_PROFILE = 60
+
+# Profile fields each prompt depends on, used to key cached plans
+MEAL_PLAN_PROFILE_FIELDS = ('age', 'weight', 'height', 'goals', 'dietary_restrictions', 'activity_level', 'meal_preferences')
+WORKOUT_PLAN_PROFILE_FIELDS = ('age', 'weight', 'height', 'goals', 'activity_level')
+
+# Activity level multipliers
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,
+    'light': 1.375,
+    'moderate': 1.55,
+    'active': 1.725,
+    'very_active': 1.9
+}
+
+# Goal-specific adjustments, checked in order; the first goal the user has wins
+GOAL_CALORIE_ADJUSTMENTS = (
+    ('weight_loss', -500),  # Create a deficit
+    ('muscle_gain', 300),   # Create a surplus
+)
+DEFAULT_CALORIE_ADJUSTMENT = 0
+
+# (protein, carb, fat) shares of daily calories
+GOAL_MACRO_RATIOS = (
+    ('muscle_gain', (0.35, 0.45, 0.20)),
+    ('weight_loss', (0.40, 0.30, 0.30)),
+)
+DEFAULT_MACRO_RATIOS = (0.30, 0.45, 0.25)
+
+MEAL_TIMING = {
+    'breakfast': '15-25% of daily calories',
+    'lunch': '25-35% of daily calories',
+    'dinner': '25-35% of daily calories',
+    'snacks': '15-25% of daily calories'
+}
+
+MICRONUTRIENT_FOCUS = (
+    'Vitamin D',
+    'Omega-3 fatty acids',
+    'Iron',
+    'Calcium',
+    'Magnesium',
+    'Zinc'
+)
+
+BASE_SUPPLEMENTS = (
+    {
+        'name': 'Multivitamin',
+        'dosage': '1 tablet',
+        'timing': 'With breakfast',
+        'purpose': 'Fill potential micronutrient gaps'
+    },
+)
+
+# Extra recommendations per goal, listed after the base ones in table order
+GOAL_SUPPLEMENTS = {
+    'muscle_gain': (
+        {
+            'name': 'Creatine Monohydrate',
+            'dosage': '5g daily',
+            'timing': 'Any time',
+            'purpose': 'Improve strength and muscle gains'
+        },
+        {
+            'name': 'Whey Protein',
+            'dosage': '25-30g',
+            'timing': 'Post-workout',
+            'purpose': 'Support muscle recovery and growth'
+        }
+    ),
+}
+
+# How long background nutrient lookups for a plan can be polled
+ENRICHMENT_TTL = 86400
+# Failed enrichments expire sooner, so a plan served again from the cache retries them
+ENRICHMENT_FAILED_TTL = 300
+
+# Cache writes run after the response; cap how many hit Redis and the embeddings API at once
+CACHE_WRITE_CONCURRENCY = 256
+
+NUTRIENT_CACHE_SIZE = 4096
+NUTRIENT_CACHE_TTL = 86400  # OpenFoodFacts data is near-static, keep lookups for a day
+NUTRIENT_MISS_CACHE_TTL = 3600  # Foods with no match are looked up again sooner
+
+OPENFOODFACTS_HEADERS = {
+    "User-Agent": os.getenv("OPENFOODFACTS_USER_AGENT", "HealthNutritionAPI - Python")
+}
+# OpenFoodFacts per-100g keys, in the same order as the fields we return
+OPENFOODFACTS_NUTRIENT_KEYS = ("energy-kcal_100g", "proteins_100g", "carbohydrates_100g", "fat_100g", "fiber_100g")
+NUTRIENT_FIELDS = ("calories", "protein", "carbs", "fat", "fiber")
+OPENFOODFACTS_TIMEOUT = httpx.Timeout(3.0, connect=3.05)
+OPENFOODFACTS_MAX_ATTEMPTS = 3
+OPENFOODFACTS_BACKOFF = 0.5  # seconds, doubled after each failed attempt and jittered
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Upper bound on in-flight OpenFoodFacts requests, to stay polite to the public API
+OPENFOODFACTS_CONCURRENCY = 20
+# OpenFoodFacts allows about 10 searches per minute per client; each worker gets its share
+openfoodfacts_search_limiter = AsyncRateLimiter(
+    max(1, int(os.getenv("OPENFOODFACTS_SEARCHES_PER_MINUTE", 10)) // WORKER_COUNT), period=60
+)
+# Meal labels the model puts in front of item names, e.g. "Breakfast: Oatmeal with berries"
+MEAL_LABEL_PATTERN = re.compile(
+    r"^\s*(?:[a-z-]+\s+)?(?:breakfast|brunch|lunch|dinner|supper|snacks?|meal)(?:\s*\d+)?\s*:\s*",
+    re.IGNORECASE
+)
+
+def compute_nutrition_goals(weight: float, height: float, age: float, activity_multiplier: float,
+                            calorie_adjustment: float, protein_ratio: float, carb_ratio: float,
+                            fat_ratio: float) -> Tuple[float, float, float, float, float]:
+    """Return (calories, protein, carbs, fat, fiber) for one profile.
+
+    Pure arithmetic shared by every nutrition goal calculation.
+    """
+    # Base metabolic rate using the Mifflin-St Jeor equation
+    bmr = (10 * weight) + (6.25 * height) - (5 * age)
+    # TDEE (Total Daily Energy Expenditure) adjusted for the user's goal
+    calories = bmr * activity_multiplier + calorie_adjustment
+    protein = (calories * protein_ratio) / 4  # 4 calories per gram of protein
+    carbs = (calories * carb_ratio) / 4       # 4 calories per gram of carbs
+    fat = (calories * fat_ratio) / 9          # 9 calories per gram of fat
+    fiber = weight * 0.5  # 0.5g fiber per kg of body weight
+    return calories, protein, carbs, fat, fiber
+
+def goal_lookup(goals: FrozenSet[str], table: Tuple[Tuple[str, T], ...], default: T) -> T:
+    """Return the value of the first goal in table that the user has."""
+    return next((value for goal, value in table if goal in goals), default)
+
+MEAL_PLAN_SYSTEM_PROMPT = """You are an expert nutritionist and meal planner. Generate evidence-based meal plans.
+IMPORTANT: 
+1. You must ONLY return a valid JSON object. Do not include ANY explanatory text.
+2. Your entire response must be parseable as JSON.
+3. You MUST include ALL 7 days of the week in the 'meals' object: monday, tuesday, wednesday, thursday, friday, saturday, and sunday.
+4. Each day MUST have at least 5 meals (3 main meals + 2 snacks).
+5. Each meal must include all required fields (item, portion, nutrients, etc.).
+6. Include detailed nutritional information for each meal.
+7. DO NOT use [...] or placeholder values.
+8. DO NOT skip any days - all seven days are required."""
+
+MEAL_PLAN_JSON_STRUCTURE = """
+{
+    "meals": {
+        "monday": [
+            {
+                "item": "Breakfast: Oatmeal with berries",
+                "portion": "1 cup oats, 1/2 cup berries",
+                "nutrients": {
+                    "calories": 300,
+                    "protein": 10,
+                    "carbs": 45,
+                    "fat": 6,
+                    "fiber": 8,
+                    "vitamins": ["B", "C", "D"]
+                },
+                "preparation_time": 15,
+                "difficulty_level": "easy",
+                "alternatives": ["Whole grain toast with avocado", "Protein smoothie bowl"]
+            }
+        ]
+    },
+    "meal_timing": {
+        "breakfast": "7:00 AM",
+        "lunch": "12:30 PM",
+        "dinner": "6:30 PM",
+        "snacks": "10:00 AM, 3:30 PM"
+    },
+    "hydration_guidelines": "Drink 8-10 glasses of water daily",
+    "preparation_tips": [
+        "Meal prep on Sundays",
+        "Store proteins separately"
+    ],
+    "storage_instructions": [
+        "Keep prepared meals refrigerated",
+        "Use airtight containers"
+    ],
+    "total_calories": 2500,
+    "total_protein": 180,
+    "total_carbs": 300,
+    "total_fat": 70,
+    "total_fiber": 35
+}
+"""
+
+MEAL_PLAN_REQUIREMENTS = """
+For EACH DAY of the week (monday through sunday), include:
+1. 3 main meals (breakfast, lunch, dinner)
+2. 2-3 snacks
+3. Each meal must include:
+   - Exact item name and description
+   - Precise portions
+   - Complete nutritional information (calories, protein, carbs, fat, fiber)
+   - Optional vitamins list
+   - Preparation time in minutes
+   - Difficulty level (easy, medium, hard)
+   - At least 2 alternatives
+4. Meal timing for all meals
+5. Comprehensive hydration guidelines
+6. At least 3 preparation tips
+7. At least 3 storage instructions
+8. Accurate total nutritional values
+"""
+
+MEAL_PLAN_PROFILE_BLOCK = Template("""Age: $age years
+Weight: $weight kg
+Height: $height cm
+Goals: $goals
+Dietary Restrictions: $dietary_restrictions
+Activity Level: $activity_level
+Meal Preferences: $meal_preferences""")
+
+# Only the $-placeholders in the profile block vary between requests, so the
+# schema is embedded as-is without brace escaping. The block goes last so the
+# system message, schema and requirements form an identical prefix that
+# OpenAI's prompt caching can reuse across users.
+MEAL_PLAN_PROMPT_TEMPLATE = Template(
+    """Generate a detailed, nutritionally balanced meal plan in JSON format for the profile at the end of this message.
+
+The response should be a valid JSON object with the following structure:
+"""
+    + MEAL_PLAN_JSON_STRUCTURE
+    + """
+Requirements:
+"""
+    + MEAL_PLAN_REQUIREMENTS
+    + """
+Profile:
+"""
+    + MEAL_PLAN_PROFILE_BLOCK.template
+)
+
+# Several numbered profiles in one request, for cohort jobs limited by requests per minute
+MEAL_PLAN_MULTI_PROMPT = (
+    """Generate a separate, detailed, nutritionally balanced meal plan for each numbered profile at the end of this message.
+
+Respond in JSON format with a single object {"plans": [...]} holding one plan per profile, in profile order. Each plan must have a "user_id" field set to its profile number, plus the following structure:
+"""
+    + MEAL_PLAN_JSON_STRUCTURE
+    + """
+Requirements for every plan:
+"""
+    + MEAL_PLAN_REQUIREMENTS
+)
+
+WORKOUT_PLAN_SYSTEM_PROMPT = """You are an expert fitness trainer. Generate concise workout plans.
+IMPORTANT:
+1. Intensity level must be lowercase: 'low', 'medium', or 'high'
+2. Rest days must be [{"exercise": "Rest"}]
+3. Maximum 3-5 exercises per day
+4. Use abbreviated formats: '4x8-12' instead of '4 sets of 8-12 reps'"""
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+WORKOUT_PLAN_JSON_STRUCTURE = """
+{
+    "weekly_schedule": {
+        "monday": [
+            {
+                "exercise": "Barbell Squats",
+                "sets": "4 sets of 8-12 reps",
+                "duration": "15 min"
+            }
+        ]
+    },
+    "intensity_level": "High",
+    "estimated_calories_burn": 3000,
+    "warm_up": [
+        "5-10 minutes light cardio",
+        "Dynamic stretching for major muscle groups"
+    ],
+    "cool_down": [
+        "5 minutes light cardio",
+        "Static stretching"
+    ],
+    "safety_precautions": [
+        "Always warm up properly",
+        "Use proper form",
+        "Start with lighter weights"
+    ],
+    "progression_tips": [
+        "Increase weight by 5-10% when you can complete all sets",
+        "Focus on form before increasing weight"
+    ]
+}
+"""
+
+WORKOUT_PLAN_REQUIREMENTS = """
+For each training day:
+1. Include 4-6 exercises for training days
+2. Each exercise must include:
+   - Exercise name and description
+   - Sets and reps or duration
+   - Rest periods between sets
+3. Mix of compound and isolation exercises
+4. Include both strength and cardio components
+5. Proper form descriptions
+6. Rest days should be marked explicitly
+7. Progressive overload recommendations
+8. Comprehensive warm-up and cool-down routines
+
+IMPORTANT: Do not use [...] placeholders. Provide complete workout data for all 7 days.
+"""
+
+# Profile block last for the same prompt-caching reason as the meal plan
+WORKOUT_PLAN_PROMPT_TEMPLATE = Template(
+    """Generate a detailed workout plan in JSON format for the profile at the end of this message.
+
+The response should be a valid JSON object with the following structure:
+"""
+    + WORKOUT_PLAN_JSON_STRUCTURE
+    + """
+Requirements:
+"""
+    + WORKOUT_PLAN_REQUIREMENTS
+    + """
+Profile:
+Age: $age years
+Weight: $weight kg
+Height: $height cm
+Goals: $goals
+Activity Level: $activity_level"""
+)
 
 class HealthCoach:
-    def __init__(self):
-        self.OPENFOODFACTS_URL = "https://world.openfoodfacts.org/api/v0/product/"
+    def __init__(self, redis_client=None, nutrient_store: Optional[NutrientStore] = None):
+        self.redis_client = redis_client
+        self.nutrient_store = nutrient_store
+        self.plan_cache = SemanticCache(redis_client=redis_client, openai_client=client, breaker=openai_breaker)
+        # Food names are searched; /api/v0/product/ only looks up barcodes
+        self.OPENFOODFACTS_URL = "https://world.openfoodfacts.org/cgi/search.pl"
+        self._nutrient_cache = OrderedDict()
+        # One pooled client so OpenFoodFacts lookups reuse keep-alive connections
+        self.http = httpx.AsyncClient(
+            headers=OPENFOODFACTS_HEADERS,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            timeout=OPENFOODFACTS_TIMEOUT
+        )
+        self.openfoodfacts_breaker = CircuitBreaker("OpenFoodFacts", fail_max=5, reset_timeout=30)
+        # Strong references to fire-and-forget tasks so they are not garbage collected mid-run
+        self._background_tasks = set()
+        # Created on first use so it binds to the running event loop
+        self._openfoodfacts_semaphore: Optional[asyncio.Semaphore] = None
+        self._cache_write_semaphore: Optional[asyncio.Semaphore] = None
+
+    async def aclose(self):
+        """Cancel background work and close the pooled HTTP client and the nutrient store."""
+        for task in self._background_tasks:
+            task.cancel()
+        await self.http.aclose()
+        if self.nutrient_store is not None:
+            self.nutrient_store.close()
+
+    def _spawn(self, coro: Awaitable) -> asyncio.Task:
+        """Run coro in the background, keeping it referenced until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _bounded_cache_write(self, write: Awaitable):
+        if self._cache_write_semaphore is None:
+            self._cache_write_semaphore = asyncio.Semaphore(CACHE_WRITE_CONCURRENCY)
+        async with self._cache_write_semaphore:
+            await write
+
+    def _write_cache_in_background(self, write: Awaitable):
+        """Store a result without making the caller wait on Redis or the embeddings API.
+
+        The writes log and swallow their own errors, so nothing is lost by
+        not awaiting them.
+        """
+        task = self._spawn(self._bounded_cache_write(write))
+        # Closes the write if the task is cancelled before it gets to run, e.g. on shutdown
+        task.add_done_callback(lambda _: write.close())
+
+    @staticmethod
+    def _chat_cache_key(messages: List[dict], max_tokens: int) -> str:
+        payload = json.dumps(
+            {"model": CHAT_MODEL, "messages": messages, "max_tokens": max_tokens,
+             "temperature": 0.0, "seed": CHAT_SEED},
+            sort_keys=True
+        )
+        return "chat:" + hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _get_cached_completion(self, key: str) -> Optional[str]:
+        if self.redis_client is None:
+            return None
+        try:
+            return await self.redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Chat cache lookup failed: {str(e)}")
+            return None
+
+    async def _set_cached_completion(self, key: str, content: str):
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.setex(key, CHAT_CACHE_TTL, content)
+        except Exception as e:
+            logger.warning(f"Chat cache write failed: {str(e)}")
+
+    @staticmethod
+    def _chat_params(messages: List[dict], max_tokens: int) -> dict:
+        # Deterministic sampling so identical prompts yield identical, cacheable output
+        return {
+            "model": CHAT_MODEL,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.0,
+            "seed": CHAT_SEED,
+            "response_format": {"type": "json_object"}  # JSON mode: the reply is a single JSON object
+        }
+
+    @staticmethod
+    def _log_completion_usage(finish_reason: Optional[str], usage, max_tokens: int):
+        # Token counts in the logs are what the max_tokens caps get tuned from
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(details, "cached_tokens", None) or 0
+            logger.info(
+                f"Completion used {usage.completion_tokens} of {max_tokens} max tokens; "
+                f"{cached_tokens} of {usage.prompt_tokens} prompt tokens served from OpenAI's prompt cache"
+            )
+        if finish_reason == "length":
+            logger.warning(f"Completion was cut off at max_tokens={max_tokens}, the JSON will be incomplete")
+
+    @staticmethod
+    def _parse_completion(content: str, parse: Callable[[str], T]) -> T:
+        try:
+            return parse(content)
+        except Exception as e:
+            logger.error(f"Error parsing AI model response: {str(e)}")
+            logger.error(f"Raw response: {content}")
+            raise ValueError("Failed to parse the response from the AI model")
+
+    @staticmethod
+    async def _create_chat_completion(chat_client: Optional[AsyncOpenAI] = None, count_timeouts: bool = True, **params):
+        """Call the chat completions API behind the shared circuit breaker and rate limiter.
+
+        Pass count_timeouts=False for long background requests, so their
+        timeouts do not open the breaker for interactive users.
+        """
+        openai_breaker.check()
+        await openai_limiter.acquire()
+        try:
+            response = await (chat_client or client).chat.completions.create(**params)
+        except APITimeoutError:
+            if count_timeouts:
+                openai_breaker.record_failure()
+            raise
+        except (APIConnectionError, InternalServerError):
+            # Timeouts and 5xx mean the API is struggling; client errors do not
+            openai_breaker.record_failure()
+            raise
+        except APIStatusError:
+            # The API answered, which is enough to close a half-open breaker
+            openai_breaker.record_success()
+            raise
+        openai_breaker.record_success()
+        return response
+
+    async def _cached_chat(self, messages: List[dict], max_tokens: int, parse: Callable[[str], T]) -> T:
+        """Return the parsed completion for messages, reusing a cached response when available.
+
+        Only completions that parse successfully are written to the cache.
+        """
+        key = self._chat_cache_key(messages, max_tokens)
+        cached = await self._get_cached_completion(key)
+        if cached is not None:
+            try:
+                return parse(cached)
+            except Exception as e:
+                logger.warning(f"Ignoring unparseable cached completion: {str(e)}")
+
+        response = await self._create_chat_completion(**self._chat_params(messages, max_tokens))
+        self._log_completion_usage(response.choices[0].finish_reason, response.usage, max_tokens)
+        result = self._parse_completion(response.choices[0].message.content, parse)
+        self._write_cache_in_background(self._set_cached_completion(key, response.choices[0].message.content))
+        return result
+
+    async def _stream_plan(self, kind: str, profile: dict, messages: List[dict], max_tokens: int,
+                           parse: Callable[[str], M], model: Type[M]) -> AsyncIterator[str]:
+        """Yield a plan's JSON text as the model generates it.
+
+        Cached plans and completions are yielded in one piece. A streamed
+        completion is parsed once it ends and cached like a regular one.
+        """
+        cached_plan = await self.plan_cache.get(kind, profile, model)
+        if cached_plan is not None:
+            yield cached_plan.model_dump_json()
+            return
+
+        key = self._chat_cache_key(messages, max_tokens)
+        cached = await self._get_cached_completion(key)
+        if cached is not None:
+            yield cached
+            return
+
+        stream = await self._create_chat_completion(
+            **self._chat_params(messages, max_tokens),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        parts = []
+        finish_reason = usage = None
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+        self._log_completion_usage(finish_reason, usage, max_tokens)
+        content = "".join(parts)
+        try:
+            plan = self._parse_completion(content, parse)
+        except ValueError:
+            # Already logged and the client has the text; just keep it out of the caches
+            return
+        self._write_cache_in_background(self._set_cached_completion(key, content))
+        self._write_cache_in_background(self.plan_cache.set(kind, profile, plan))
 
     def _is_rest_day(self, exercises):
         """Check if a day is a rest day by looking at its exercises."""
@@ -19,392 +585,301 @@ class HealthCoach:
             return True
         return False
 
-    def generate_meal_plan(self, input_data: dict) -> MealPlan:
+    @staticmethod
+    def _prompt_fields(profile: dict) -> defaultdict:
+        """Render profile values for prompt substitution; missing fields come out empty."""
+        return defaultdict(str, {
+            key: ', '.join(value) if isinstance(value, list) else ('' if value is None else value)
+            for key, value in profile.items()
+        })
+
+    def _meal_plan_messages(self, input_data: dict) -> List[dict]:
+        """Build the chat messages for a meal plan request."""
+        return [
+            {"role": "system", "content": MEAL_PLAN_SYSTEM_PROMPT},
+            {"role": "user", "content": MEAL_PLAN_PROMPT_TEMPLATE.substitute(self._prompt_fields(input_data))}
+        ]
+
+    async def generate_meal_plan(self, input_data: dict) -> MealPlan:
         """Generate a personalized meal plan based on user preferences."""
         try:
-            user_profile = f"""
-            Age: {input_data.get('age')} years
-            Weight: {input_data.get('weight')} kg
-            Height: {input_data.get('height')} cm
-            Goals: {', '.join(input_data.get('goals', []))}
-            Dietary Restrictions: {', '.join(input_data.get('dietary_restrictions', []))}
-            Activity Level: {input_data.get('activity_level')}
-            Meal Preferences: {', '.join(input_data.get('meal_preferences', []))}
-            """
-
-            json_structure = """
-            {
-                "meals": {
-                    "monday": [
-                        {
-                            "item": "Breakfast: Oatmeal with berries",
-                            "portion": "1 cup oats, 1/2 cup berries",
-                            "nutrients": {
-                                "calories": 300,
-                                "protein": 10,
-                                "carbs": 45,
-                                "fat": 6,
-                                "fiber": 8,
-                                "vitamins": ["B", "C", "D"]
-                            },
-                            "preparation_time": 15,
-                            "difficulty_level": "easy",
-                            "alternatives": ["Whole grain toast with avocado", "Protein smoothie bowl"]
-                        }
-                    ]
-                },
-                "meal_timing": {
-                    "breakfast": "7:00 AM",
-                    "lunch": "12:30 PM",
-                    "dinner": "6:30 PM",
-                    "snacks": "10:00 AM, 3:30 PM"
-                },
-                "hydration_guidelines": "Drink 8-10 glasses of water daily",
-                "preparation_tips": [
-                    "Meal prep on Sundays",
-                    "Store proteins separately"
-                ],
-                "storage_instructions": [
-                    "Keep prepared meals refrigerated",
-                    "Use airtight containers"
-                ],
-                "total_calories": 2500,
-                "total_protein": 180,
-                "total_carbs": 300,
-                "total_fat": 70,
-                "total_fiber": 35
-            }
-            """
-
-            requirements = """
-            For EACH DAY of the week (monday through sunday), include:
-            1. 3 main meals (breakfast, lunch, dinner)
-            2. 2-3 snacks
-            3. Each meal must include:
-               - Exact item name and description
-               - Precise portions
-               - Complete nutritional information (calories, protein, carbs, fat, fiber)
-               - Optional vitamins list
-               - Preparation time in minutes
-               - Difficulty level (easy, medium, hard)
-               - At least 2 alternatives
-            4. Meal timing for all meals
-            5. Comprehensive hydration guidelines
-            6. At least 3 preparation tips
-            7. At least 3 storage instructions
-            8. Accurate total nutritional values
-
-            IMPORTANT: Do not use [...] placeholders. Provide complete data for all 7 days.
-            """
-
-            prompt = f"""Generate a detailed, nutritionally balanced meal plan in JSON format for someone with the following profile:
-{user_profile}
+            profile = {field: input_data.get(field) for field in MEAL_PLAN_PROFILE_FIELDS}
+            cached = await self.plan_cache.get("meal_plan", profile, MealPlan)
+            if cached is not None:
+                return cached
+
+            messages = self._meal_plan_messages(input_data)
+            meal_plan = await self._cached_chat(messages, max_tokens=MEAL_PLAN_MAX_TOKENS, parse=self._parse_meal_plan_response)
+            self._write_cache_in_background(self.plan_cache.set("meal_plan", profile, meal_plan))
+            return meal_plan
+
+        except (APIError, CircuitOpenError):
+            raise
+        except Exception as e:
+            raise ValueError(f"Error generating meal plan: {str(e)}")
 
-The response should be a valid JSON object with the following structure:
-{json_structure}
+    async def _run_chat_batch(self, requests: Dict[str, dict], timeout: float) -> Dict[str, str]:
+        """Submit chat completion requests as one Batch API job and collect the replies.
 
-Requirements:
-{requirements}
+        Returns completion content by custom_id. Requests that fail, and every
+        request when the job does not finish within timeout, are left out.
+        """
+        lines = (
+            orjson.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+            for custom_id, body in requests.items()
+        )
+        batch_file = await client.files.create(file=("requests.jsonl", b"\n".join(lines)), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
 
-The response must be a valid JSON object that can be parsed directly."""
+        deadline = time.monotonic() + timeout
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Batch {batch.id} did not finish within {timeout}s, cancelling")
+                await client.batches.cancel(batch.id)
+                return {}
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            batch = await client.batches.retrieve(batch.id)
+
+        if batch.status != "completed" or not batch.output_file_id:
+            logger.warning(f"Batch {batch.id} ended with status {batch.status}")
+            return {}
 
-            messages = [
-                {
-                    "role": "system", 
-                    "content": """You are an expert nutritionist and meal planner. Generate evidence-based meal plans.
-IMPORTANT: 
-1. You must ONLY return a valid JSON object. Do not include ANY explanatory text.
-2. Your entire response must be parseable as JSON.
-3. You MUST include ALL 7 days of the week in the 'meals' object: monday, tuesday, wednesday, thursday, friday, saturday, and sunday.
-4. Each day MUST have at least 5 meals (3 main meals + 2 snacks).
-5. Each meal must include all required fields (item, portion, nutrients, etc.).
-6. Include detailed nutritional information for each meal.
-7. DO NOT use [...] or placeholder values.
-8. DO NOT skip any days - all seven days are required."""
-                },
-                {"role": "user", "content": prompt}
-            ]
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo-1106",  # Using the latest GPT-3.5 model for faster responses
-                messages=messages,
-                max_tokens=4000,
-                temperature=0.7,
-                timeout=60,  # Reduced timeout since GPT-3.5 is faster
-                response_format={ "type": "json" }  # Ensure JSON response
+        output = await client.files.content(batch.output_file_id)
+        contents = {}
+        for line in output.text.splitlines():
+            if not line:
+                continue
+            result = orjson.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                contents[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return contents
+
+    async def _generate_plans_bulk(self, kind: str, profiles: List[dict], fields: Tuple[str, ...],
+                                   build_messages: Callable[[dict], List[dict]], max_tokens: int,
+                                   parse: Callable[[str], M], model: Type[M],
+                                   generate_one: Callable[[dict], Awaitable[M]], timeout: float) -> List[Optional[M]]:
+        """Generate plans for many users through the OpenAI Batch API.
+
+        Cached plans are reused, the rest are submitted as one batch at half
+        the token price. Plans the batch does not deliver in time are
+        generated with regular completions instead; None marks a profile
+        whose plan could not be generated either way.
+        """
+        subsets = [{field: profile.get(field) for field in fields} for profile in profiles]
+        plans: List[Optional[M]] = await self.plan_cache.get_many(kind, subsets, model)
+
+        messages = {str(i): build_messages(profiles[i]) for i, plan in enumerate(plans) if plan is None}
+        if messages:
+            contents = await self._run_chat_batch(
+                {custom_id: self._chat_params(msgs, max_tokens) for custom_id, msgs in messages.items()},
+                timeout
             )
+            for custom_id, content in contents.items():
+                i = int(custom_id)
+                try:
+                    plans[i] = self._parse_completion(content, parse)
+                except ValueError:
+                    continue
+                await self._set_cached_completion(self._chat_cache_key(messages[custom_id], max_tokens), content)
+                await self.plan_cache.set(kind, subsets[i], plans[i])
+
+        missing = [i for i, plan in enumerate(plans) if plan is None]
+        if missing:
+            logger.warning(f"Generating {len(missing)} {kind.replace('_', ' ')}s without the Batch API")
+            await self._generate_missing_plans(kind, profiles, plans, missing, generate_one)
+        return plans
+
+    @staticmethod
+    async def _generate_missing_plans(kind: str, profiles: List[dict], plans: List[Optional[M]], missing: List[int],
+                                      generate_one: Callable[[dict], Awaitable[M]]):
+        """Generate plans[i] for each index in missing, one request per profile.
+
+        A profile whose request fails keeps None, so one bad completion does
+        not throw away the plans already produced for the others.
+        """
+        fallback = await asyncio.gather(*(generate_one(profiles[i]) for i in missing), return_exceptions=True)
+        for i, plan in zip(missing, fallback):
+            if isinstance(plan, BaseException):
+                logger.error(f"Could not generate {kind.replace('_', ' ')} for profile {i}: {str(plan)}")
+            else:
+                plans[i] = plan
+
+    async def generate_meal_plans_bulk(self, profiles: List[dict],
+                                       timeout: float = BATCH_TIMEOUT) -> List[Optional[MealPlan]]:
+        """Generate meal plans for many users at Batch API prices.
+
+        Meant for non-interactive jobs such as bulk onboarding or nightly
+        regeneration. None marks a profile whose plan failed.
+        """
+        return await self._generate_plans_bulk(
+            "meal_plan", profiles, MEAL_PLAN_PROFILE_FIELDS, self._meal_plan_messages, MEAL_PLAN_MAX_TOKENS,
+            self._parse_meal_plan_response, MealPlan, self.generate_meal_plan, timeout
+        )
 
-            try:
-                meal_plan_data = response.choices[0].message.content
-                if not isinstance(meal_plan_data, dict):
-                    import json
-                    json_start = meal_plan_data.find('{')
-                    json_end = meal_plan_data.rfind('}') + 1
-                    if json_start >= 0 and json_end > json_start:
-                        meal_plan_data = meal_plan_data[json_start:json_end]
-                    meal_plan_data = json.loads(meal_plan_data)
-
-                # Validate required fields
-                required_fields = ['meals', 'total_calories', 'total_protein', 'total_carbs', 'total_fat', 'total_fiber']
-                if not all(field in meal_plan_data for field in required_fields):
-                    raise ValueError("Missing required fields in meal plan data")
-
-                # Validate meal structure
-                days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-                for day in days:
-                    if day not in meal_plan_data['meals']:
-                        raise ValueError(f"Missing {day} in meal plan data")
-                    meals = meal_plan_data['meals'][day]
-                    if not isinstance(meals, list) or len(meals) < 5:
-                        raise ValueError(f"Insufficient meals for {day}")
-                    
-                    # Validate each meal item
-                    for meal in meals:
-                        required_meal_fields = ['item', 'portion']
-                        if not all(field in meal for field in required_meal_fields):
-                            raise ValueError(f"Missing required fields in meal item for {day}")
-                        
-                        if 'nutrients' in meal:
-                            required_nutrient_fields = ['calories', 'protein', 'carbs', 'fat', 'fiber']
-                            if not all(field in meal['nutrients'] for field in required_nutrient_fields):
-                                raise ValueError(f"Missing required nutrient fields in meal item for {day}")
-
-                meal_plan = MealPlan(
-                    meals=meal_plan_data["meals"],
-                    meal_timing=meal_plan_data.get("meal_timing"),
-                    hydration_guidelines=meal_plan_data.get("hydration_guidelines"),
-                    preparation_tips=meal_plan_data.get("preparation_tips"),
-                    storage_instructions=meal_plan_data.get("storage_instructions"),
-                    total_calories=meal_plan_data["total_calories"],
-                    total_protein=meal_plan_data["total_protein"],
-                    total_carbs=meal_plan_data["total_carbs"],
-                    total_fat=meal_plan_data["total_fat"],
-                    total_fiber=meal_plan_data["total_fiber"]
-                )
-
-                return meal_plan
+    async def generate_workout_plans_bulk(self, profiles: List[dict],
+                                          timeout: float = BATCH_TIMEOUT) -> List[Optional[WorkoutPlan]]:
+        """Generate workout plans for many users at Batch API prices; None marks a profile whose plan failed."""
+        return await self._generate_plans_bulk(
+            "workout_plan", profiles, WORKOUT_PLAN_PROFILE_FIELDS, self._workout_plan_messages,
+            WORKOUT_PLAN_MAX_TOKENS, self._parse_workout_plan_response, WorkoutPlan,
+            self.generate_workout_plan, timeout
+        )
 
-            except Exception as e:
-                import logging
-                logging.error(f"Error parsing meal plan: {str(e)}")
-                logging.error(f"Raw response: {meal_plan_data}")
-                raise ValueError("Failed to parse the meal plan response from the AI model")
+    async def _generate_meal_plan_group(self, profiles: List[dict]) -> List[Optional[MealPlan]]:
+        """Request plans for several profiles in one completion.
 
-        except Exception as e:
-            raise ValueError(f"Error generating meal plan: {str(e)}")
+        Returns one entry per profile, None where the reply has no valid plan.
+        """
+        content = "\n\n".join([MEAL_PLAN_MULTI_PROMPT] + [
+            f"Profile {number}:\n" + MEAL_PLAN_PROFILE_BLOCK.substitute(self._prompt_fields(profile))
+            for number, profile in enumerate(profiles, 1)
+        ])
+        messages = [
+            {"role": "system", "content": MEAL_PLAN_SYSTEM_PROMPT},
+            {"role": "user", "content": content}
+        ]
+        max_tokens = MEAL_PLAN_MAX_TOKENS * len(profiles)
+        # The shared client's 60s timeout and retries suit one plan, not several; a group
+        # that still times out is not retried, its profiles fall back to single requests
+        group_client = client.with_options(timeout=MULTI_PLAN_SECONDS_PER_PROFILE * len(profiles), max_retries=0)
+        response = await self._create_chat_completion(
+            chat_client=group_client, count_timeouts=False, **self._chat_params(messages, max_tokens)
+        )
+        self._log_completion_usage(response.choices[0].finish_reason, response.usage, max_tokens)
 
-    async def generate_workout_plan(self, profile_data: dict) -> WorkoutPlan:
-        """Generate a comprehensive workout plan based on user profile."""
+        entries = {}
         try:
-            user_profile = f"""
-            Age: {profile_data.get('age')} years
-            Weight: {profile_data.get('weight')} kg
-            Height: {profile_data.get('height')} cm
-            Goals: {', '.join(profile_data.get('goals', []))}
-            Activity Level: {profile_data.get('activity_level')}
-            """
-
-            json_structure = """
-            {
-                "weekly_schedule": {
-                    "monday": [
-                        {
-                            "exercise": "Barbell Squats",
-                            "sets": "4 sets of 8-12 reps",
-                            "duration": "15 min"
-                        }
-                    ]
-                },
-                "intensity_level": "High",
-                "estimated_calories_burn": 3000,
-                "warm_up": [
-                    "5-10 minutes light cardio",
-                    "Dynamic stretching for major muscle groups"
-                ],
-                "cool_down": [
-                    "5 minutes light cardio",
-                    "Static stretching"
-                ],
-                "safety_precautions": [
-                    "Always warm up properly",
-                    "Use proper form",
-                    "Start with lighter weights"
-                ],
-                "progression_tips": [
-                    "Increase weight by 5-10% when you can complete all sets",
-                    "Focus on form before increasing weight"
-                ]
-            }
-            """
-
-            requirements = """
-            For each training day:
-            1. Include 4-6 exercises for training days
-            2. Each exercise must include:
-               - Exercise name and description
-               - Sets and reps or duration
-               - Rest periods between sets
-            3. Mix of compound and isolation exercises
-            4. Include both strength and cardio components
-            5. Proper form descriptions
-            6. Rest days should be marked explicitly
-            7. Progressive overload recommendations
-            8. Comprehensive warm-up and cool-down routines
-
-            IMPORTANT: Do not use [...] placeholders. Provide complete workout data for all 7 days.
-            """
-
-            prompt = f"""Generate a detailed workout plan in JSON format for someone with the following profile:
-{user_profile}
+            for entry in orjson.loads(response.choices[0].message.content)["plans"]:
+                entries[int(entry.pop("user_id"))] = entry
+        except Exception as e:
+            logger.warning(f"Unreadable multi-profile meal plan response: {str(e)}")
 
-The response should be a valid JSON object with the following structure:
-{json_structure}
+        plans = []
+        for number in range(1, len(profiles) + 1):
+            try:
+                plans.append(MealPlan.model_validate(entries[number]))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"No valid meal plan for profile {number} in multi-profile response: {str(e)}")
+                plans.append(None)
+        return plans
+
+    async def generate_meal_plans_multi(self, profiles: List[dict]) -> List[Optional[MealPlan]]:
+        """Generate meal plans for several users with one completion per group of profiles.
+
+        For cohort jobs limited by requests per minute rather than tokens:
+        profiles are sent MULTI_PLAN_GROUP_SIZE at a time, so the shared
+        instructions are sent once per group. Cached plans are reused and any
+        plan missing from a reply is generated on its own. None marks a
+        profile whose plan failed.
+        """
+        subsets = [{field: profile.get(field) for field in MEAL_PLAN_PROFILE_FIELDS} for profile in profiles]
+        plans: List[Optional[MealPlan]] = await self.plan_cache.get_many("meal_plan", subsets, MealPlan)
+
+        pending = [i for i, plan in enumerate(plans) if plan is None]
+        groups = [pending[start:start + MULTI_PLAN_GROUP_SIZE] for start in range(0, len(pending), MULTI_PLAN_GROUP_SIZE)]
+        replies = await asyncio.gather(
+            *(self._generate_meal_plan_group([profiles[i] for i in group]) for group in groups),
+            return_exceptions=True
+        )
+        for group, reply in zip(groups, replies):
+            if isinstance(reply, BaseException):
+                logger.warning(f"Multi-profile meal plan request failed: {str(reply)}")
+                continue
+            for i, plan in zip(group, reply):
+                if plan is not None:
+                    plans[i] = plan
+                    await self.plan_cache.set("meal_plan", subsets[i], plan)
+
+        missing = [i for i, plan in enumerate(plans) if plan is None]
+        if missing:
+            await self._generate_missing_plans("meal_plan", profiles, plans, missing, self.generate_meal_plan)
+        return plans
+
+    def _workout_plan_messages(self, profile_data: dict) -> List[dict]:
+        """Build the chat messages for a workout plan request."""
+        return [
+            {"role": "system", "content": WORKOUT_PLAN_SYSTEM_PROMPT},
+            {"role": "user", "content": WORKOUT_PLAN_PROMPT_TEMPLATE.substitute(self._prompt_fields(profile_data))}
+        ]
 
-Requirements:
-{requirements}
+    def stream_meal_plan(self, input_data: dict) -> AsyncIterator[bytes]:
+        """Stream a meal plan as NDJSON while the model is still generating it.
 
-The response must be a valid JSON object that can be parsed directly."""
+        Each day's meals are emitted as soon as the model has finished them,
+        so callers can render Monday long before Sunday is written.
+        """
+        profile = {field: input_data.get(field) for field in MEAL_PLAN_PROFILE_FIELDS}
+        return stream_plan_ndjson(
+            self._stream_plan("meal_plan", profile, self._meal_plan_messages(input_data),
+                              MEAL_PLAN_MAX_TOKENS, self._parse_meal_plan_response, MealPlan),
+            MealPlan, section="meals", item_key="meals", day_type=MEAL_PLAN_DAY
+        )
 
-            messages = [
-                {
-                    "role": "system", 
-                    "content": """You are an expert fitness trainer. Generate concise workout plans.
-IMPORTANT:
-1. Intensity level must be lowercase: 'low', 'medium', or 'high'
-2. Rest days must be [{"exercise": "Rest"}]
-3. Maximum 3-5 exercises per day
-4. Use abbreviated formats: '4x8-12' instead of '4 sets of 8-12 reps'"""
-                },
-                {"role": "user", "content": prompt}
-            ]
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo-1106",  # Using the latest GPT-3.5 model for faster responses
-                messages=messages,
-                max_tokens=2000,
-                temperature=0.7,
-                timeout=60,  # Reduced timeout since GPT-3.5 is faster
-                response_format={ "type": "json" }  # Ensure JSON response
-            )
+    async def generate_workout_plan(self, profile_data: dict) -> WorkoutPlan:
+        """Generate a comprehensive workout plan based on user profile."""
+        try:
+            profile = {field: profile_data.get(field) for field in WORKOUT_PLAN_PROFILE_FIELDS}
+            cached = await self.plan_cache.get("workout_plan", profile, WorkoutPlan)
+            if cached is not None:
+                return cached
+
+            messages = self._workout_plan_messages(profile_data)
+            workout_plan = await self._cached_chat(messages, max_tokens=WORKOUT_PLAN_MAX_TOKENS, parse=self._parse_workout_plan_response)
+            self._write_cache_in_background(self.plan_cache.set("workout_plan", profile, workout_plan))
+            return workout_plan
+
+        except (APIError, CircuitOpenError):
+            raise
+        except Exception as e:
+            raise ValueError(f"Error generating workout plan: {str(e)}")
 
-            try:
-                workout_data = response.choices[0].message.content
-                if not isinstance(workout_data, dict):
-                    import json
-                    json_start = workout_data.find('{')
-                    json_end = workout_data.rfind('}') + 1
-                    if json_start >= 0 and json_end > json_start:
-                        workout_data = workout_data[json_start:json_end]
-                    workout_data = json.loads(workout_data)
-
-                # Convert string rest days to proper format
-                for day, exercises in workout_data['weekly_schedule'].items():
-                    if isinstance(exercises, str) and exercises.lower() == 'rest':
-                        workout_data['weekly_schedule'][day] = [{"exercise": "Rest"}]
-                    elif not isinstance(exercises, list):
-                        raise ValueError(f"Invalid exercise data for {day}")
-
-                # Validate required fields
-                required_fields = ['weekly_schedule', 'intensity_level', 'estimated_calories_burn']
-                if not all(field in workout_data for field in required_fields):
-                    raise ValueError("Missing required fields in workout plan data")
-
-                # Validate weekly schedule
-                days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-                for day in days:
-                    if day not in workout_data['weekly_schedule']:
-                        raise ValueError(f"Missing {day} in workout schedule")
-                    
-                    exercises = workout_data['weekly_schedule'][day]
-                    if not isinstance(exercises, list):
-                        raise ValueError(f"Invalid exercise data for {day}")
-                    
-                    # Skip detailed validation for rest days
-                    if len(exercises) == 1 and exercises[0].get('exercise', '').lower() == 'rest':
-                        continue
-                        
-                    # Validate each exercise
-                    for exercise in exercises:
-                        if not isinstance(exercise, dict):
-                            raise ValueError(f"Invalid exercise format in {day}")
-                        if 'exercise' not in exercise:
-                            raise ValueError(f"Missing exercise name in {day}")
-                        if exercise['exercise'].lower() != 'rest' and not any(k in exercise for k in ['sets', 'duration']):
-                            raise ValueError(f"Exercise must have either sets or duration in {day}")
-
-                workout_plan = WorkoutPlan(
-                    weekly_schedule=workout_data["weekly_schedule"],
-                    intensity_level=workout_data["intensity_level"],
-                    estimated_calories_burn=workout_data["estimated_calories_burn"],
-                    warm_up=workout_data.get("warm_up"),
-                    cool_down=workout_data.get("cool_down"),
-                    safety_precautions=workout_data.get("safety_precautions"),
-                    progression_tips=workout_data.get("progression_tips")
-                )
-
-                return workout_plan
+    def stream_workout_plan(self, profile_data: dict) -> AsyncIterator[bytes]:
+        """Stream a workout plan as NDJSON, one line per day, while it is being generated."""
+        profile = {field: profile_data.get(field) for field in WORKOUT_PLAN_PROFILE_FIELDS}
+        return stream_plan_ndjson(
+            self._stream_plan("workout_plan", profile, self._workout_plan_messages(profile_data),
+                              WORKOUT_PLAN_MAX_TOKENS, self._parse_workout_plan_response, WorkoutPlan),
+            WorkoutPlan, section="weekly_schedule", item_key="exercises", day_type=WORKOUT_PLAN_DAY
+        )
 
-            except Exception as e:
-                import logging
-                logging.error(f"Error parsing workout plan: {str(e)}")
-                logging.error(f"Raw response: {workout_data}")
-                raise ValueError("Failed to parse the workout plan response from the AI model")
+    async def generate_full_plan(self, profile_data: dict) -> FullPlan:
+        """Generate meal plan, workout plan and nutrition goals concurrently."""
+        meal_plan, workout_plan, nutrition_goals = await asyncio.gather(
+            self.generate_meal_plan(profile_data),
+            self.generate_workout_plan(profile_data),
+            self.get_nutrition_goals_async(profile_data)
+        )
+        # All three parts are validated model instances already
+        return FullPlan.model_construct(
+            meal_plan=meal_plan,
+            workout_plan=workout_plan,
+            nutrition_goals=nutrition_goals
+        )
 
-        except Exception as e:
-            raise ValueError(f"Error generating workout plan: {str(e)}")
+    async def get_nutrition_goals_async(self, profile_data: dict) -> NutritionGoals:
+        """Calculate nutrition goals in a worker thread to keep the event loop free."""
+        return await asyncio.to_thread(self.get_nutrition_goals, profile_data)
 
     def get_nutrition_goals(self, profile_data: dict) -> NutritionGoals:
         """Calculate comprehensive nutrition goals based on user profile."""
-        # Calculate base metabolic rate using Mifflin-St Jeor Equation
         age = int(profile_data.get('age', 0))
         weight = float(profile_data.get('weight', 0))
         height = float(profile_data.get('height', 0))
         activity_level = profile_data.get('activity_level', 'moderate')
-        goals = profile_data.get('goals', [])
-
-        # Calculate BMR
-        bmr = (10 * weight) + (6.25 * height) - (5 * age)
-
-        # Activity level multipliers
-        activity_multipliers = {
-            'sedentary': 1.2,
-            'light': 1.375,
-            'moderate': 1.55,
-            'active': 1.725,
-            'very_active': 1.9
-        }
-
-        # Calculate TDEE (Total Daily Energy Expenditure)
-        tdee = bmr * activity_multipliers.get(activity_level, 1.55)
-
-        # Adjust calories based on goals
-        calorie_adjustment = 0
-        if 'weight_loss' in goals:
-            calorie_adjustment = -500  # Create a deficit
-        elif 'muscle_gain' in goals:
-            calorie_adjustment = 300   # Create a surplus
-
-        final_calories = tdee + calorie_adjustment
-
-        # Calculate macronutrient ratios based on goals
-        protein_ratio = 0.3  # 30% of calories from protein
-        fat_ratio = 0.25     # 25% of calories from fat
-        carb_ratio = 0.45    # 45% of calories from carbs
-
-        if 'muscle_gain' in goals:
-            protein_ratio = 0.35
-            carb_ratio = 0.45
-            fat_ratio = 0.20
-        elif 'weight_loss' in goals:
-            protein_ratio = 0.40
-            fat_ratio = 0.30
-            carb_ratio = 0.30
-
-        # Calculate macros in grams
-        protein = (final_calories * protein_ratio) / 4  # 4 calories per gram of protein
-        carbs = (final_calories * carb_ratio) / 4      # 4 calories per gram of carbs
-        fat = (final_calories * fat_ratio) / 9         # 9 calories per gram of fat
-        fiber = weight * 0.5  # 0.5g fiber per kg of body weight
+        goals = frozenset(profile_data.get('goals', []))
+        calorie_adjustment = goal_lookup(goals, GOAL_CALORIE_ADJUSTMENTS, DEFAULT_CALORIE_ADJUSTMENT)
+        protein_ratio, carb_ratio, fat_ratio = goal_lookup(goals, GOAL_MACRO_RATIOS, DEFAULT_MACRO_RATIOS)
+
+        final_calories, protein, carbs, fat, fiber = compute_nutrition_goals(
+            weight, height, age,
+            ACTIVITY_MULTIPLIERS.get(activity_level, 1.55),
+            calorie_adjustment, protein_ratio, carb_ratio, fat_ratio
+        )
 
         return NutritionGoals(
             calories=round(final_calories),
@@ -413,256 +888,251 @@ IMPORTANT:
             fat=round(fat),
             fiber=round(fiber),
             hydration=round(weight * 0.033, 1),  # 33ml per kg of body weight
-            meal_timing={
-                'breakfast': '15-25% of daily calories',
-                'lunch': '25-35% of daily calories',
-                'dinner': '25-35% of daily calories',
-                'snacks': '15-25% of daily calories'
-            },
-            micronutrient_focus=[
-                'Vitamin D',
-                'Omega-3 fatty acids',
-                'Iron',
-                'Calcium',
-                'Magnesium',
-                'Zinc'
-            ],
+            meal_timing=MEAL_TIMING,
+            micronutrient_focus=MICRONUTRIENT_FOCUS,
             supplements_recommended=self._get_supplement_recommendations(goals)
         )
 
-    def _get_supplement_recommendations(self, goals: List[str]) -> List[dict]:
+    def get_nutrition_goals_batch(self, profiles: List[dict]) -> List[NutritionGoals]:
+        """Calculate nutrition goals for many profiles in one vectorized pass.
+
+        Matches get_nutrition_goals for each profile, but runs the arithmetic
+        once over NumPy arrays instead of once per user.
+        """
+        count = len(profiles)
+        ages = np.fromiter((int(p.get('age', 0)) for p in profiles), dtype=np.float64, count=count)
+        weights = np.fromiter((float(p.get('weight', 0)) for p in profiles), dtype=np.float64, count=count)
+        heights = np.fromiter((float(p.get('height', 0)) for p in profiles), dtype=np.float64, count=count)
+        activity_multipliers = np.fromiter(
+            (ACTIVITY_MULTIPLIERS.get(p.get('activity_level', 'moderate'), 1.55) for p in profiles),
+            dtype=np.float64, count=count
+        )
+        goals = [frozenset(p.get('goals', [])) for p in profiles]
+        calorie_adjustments = np.fromiter(
+            (goal_lookup(g, GOAL_CALORIE_ADJUSTMENTS, DEFAULT_CALORIE_ADJUSTMENT) for g in goals),
+            dtype=np.float64, count=count
+        )
+        protein_ratios, carb_ratios, fat_ratios = np.array(
+            [goal_lookup(g, GOAL_MACRO_RATIOS, DEFAULT_MACRO_RATIOS) for g in goals], dtype=np.float64
+        ).reshape(count, 3).T
+
+        calories, protein, carbs, fat, fiber = (
+            np.round(values).tolist() for values in compute_nutrition_goals(
+                weights, heights, ages, activity_multipliers,
+                calorie_adjustments, protein_ratios, carb_ratios, fat_ratios
+            )
+        )
+        return [
+            NutritionGoals(calories=calories[i], protein=protein[i], carbs=carbs[i], fat=fat[i], fiber=fiber[i])
+            for i in range(count)
+        ]
+
+    def _get_supplement_recommendations(self, goals: FrozenSet[str]) -> List[dict]:
         """Get personalized supplement recommendations based on goals."""
-        base_supplements = [
-            {
-                'name': 'Multivitamin',
-                'dosage': '1 tablet',
-                'timing': 'With breakfast',
-                'purpose': 'Fill potential micronutrient gaps'
-            }
+        return list(BASE_SUPPLEMENTS) + [
+            supplement
+            for goal, supplements in GOAL_SUPPLEMENTS.items() if goal in goals
+            for supplement in supplements
         ]
 
-        if 'muscle_gain' in goals:
-            base_supplements.extend([
-                {
-                    'name': 'Creatine Monohydrate',
-                    'dosage': '5g daily',
-                    'timing': 'Any time',
-                    'purpose': 'Improve strength and muscle gains'
-                },
-                {
-                    'name': 'Whey Protein',
-                    'dosage': '25-30g',
-                    'timing': 'Post-workout',
-                    'purpose': 'Support muscle recovery and growth'
-                }
-            ])
-
-        return base_supplements
-
-    def _get_food_nutrients(self, food_item: str) -> dict:
-        """Fetch nutrition data from OpenFoodFacts API"""
+    @staticmethod
+    def _normalize_food_item(food_item: str) -> str:
+        """Normalize a food item so equivalent spellings share a cache entry.
+
+        Meal labels such as "Lunch:" are dropped, since they only get in the
+        way of the product search.
+        """
+        return " ".join(MEAL_LABEL_PATTERN.sub("", food_item).lower().split())
+
+    def _get_cached_nutrients(self, key: str):
+        entry = self._nutrient_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, nutrients = entry
+        if expires_at < time.monotonic():
+            del self._nutrient_cache[key]
+            return None
+        self._nutrient_cache.move_to_end(key)
+        return nutrients
+
+    def _set_cached_nutrients(self, key: str, nutrients: dict):
+        ttl = NUTRIENT_CACHE_TTL if nutrients else NUTRIENT_MISS_CACHE_TTL
+        self._nutrient_cache[key] = (time.monotonic() + ttl, nutrients)
+        self._nutrient_cache.move_to_end(key)
+        if len(self._nutrient_cache) > NUTRIENT_CACHE_SIZE:
+            self._nutrient_cache.popitem(last=False)
+
+    async def _search_openfoodfacts(self, key: str) -> httpx.Response:
+        """Search products by name, retrying transient failures with exponential backoff."""
+        params = {
+            "search_terms": key, "search_simple": 1, "action": "process", "json": 1,
+            "page_size": 1, "fields": "product_name,nutriments"
+        }
+        if self._openfoodfacts_semaphore is None:
+            self._openfoodfacts_semaphore = asyncio.Semaphore(OPENFOODFACTS_CONCURRENCY)
+        for attempt in range(OPENFOODFACTS_MAX_ATTEMPTS):
+            is_last_attempt = attempt == OPENFOODFACTS_MAX_ATTEMPTS - 1
+            await openfoodfacts_search_limiter.acquire()
+            try:
+                # Hold a slot only for the request itself, not the backoff sleep
+                async with self._openfoodfacts_semaphore:
+                    response = await self.http.get(self.OPENFOODFACTS_URL, params=params)
+            except httpx.TransportError:
+                if is_last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or is_last_attempt:
+                    response.raise_for_status()
+                    return response
+            delay = OPENFOODFACTS_BACKOFF * 2 ** attempt
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    async def _get_food_nutrients(self, food_item: str) -> Optional[dict]:
+        """Fetch per-100g nutrition data for the best OpenFoodFacts match.
+
+        Returns {} when OpenFoodFacts has no match and None when it could not
+        be asked, so callers can tell an unknown food from an outage.
+        """
+        key = self._normalize_food_item(food_item)
+        cached = self._get_cached_nutrients(key)
+        if cached is not None:
+            return cached
+        if self.nutrient_store is not None:
+            stored = self.nutrient_store.get(key)
+            if stored is not None:
+                self._set_cached_nutrients(key, stored)
+                return stored
+
+        if not self.openfoodfacts_breaker.allow():
+            return None
         try:
-            headers = {
-                "User-Agent": os.getenv("OPENFOODFACTS_USER_AGENT", "HealthNutritionAPI - Python")
-            }
-            response = requests.get(f"{self.OPENFOODFACTS_URL}/{food_item}.json", headers=headers)
-            data = response.json()
+            try:
+                response = await self._search_openfoodfacts(key)
+            except httpx.HTTPError as e:
+                if not isinstance(e, httpx.HTTPStatusError) or e.response.status_code in RETRYABLE_STATUS_CODES:
+                    self.openfoodfacts_breaker.record_failure()
+                else:
+                    self.openfoodfacts_breaker.record_success()
+                raise
+            self.openfoodfacts_breaker.record_success()
+            data = orjson.loads(response.content)
             
-            if data.get("status") == 1:
-                nutrients = data["product"]["nutriments"]
-                return {
-                    "calories": nutrients.get("energy-kcal_100g", 0),
-                    "protein": nutrients.get("proteins_100g", 0),
-                    "carbs": nutrients.get("carbohydrates_100g", 0),
-                    "fat": nutrients.get("fat_100g", 0),
-                    "fiber": nutrients.get("fiber_100g", 0)
-                }
-            return {}
+            nutrients = {}
+            products = data.get("products") or []
+            if products:
+                # Best match first; fields it has no value for count as 0
+                product_nutrients = products[0].get("nutriments") or {}
+                nutrients = dict(zip(
+                    NUTRIENT_FIELDS,
+                    map(product_nutrients.get, OPENFOODFACTS_NUTRIENT_KEYS, repeat(0))
+                ))
+            self._set_cached_nutrients(key, nutrients)
+            if self.nutrient_store is not None:
+                self.nutrient_store.set(key, nutrients)
+            return nutrients
         except Exception:
-            return {}
-
-    def _calculate_nutrition_goals(self, profile: dict) -> NutritionGoals:
-        # Basic BMR calculation using Harris-Benedict equation
-        weight = profile["weight"]
-        height = profile["height"]
-        age = profile["age"]
-        activity_level = profile["activity_level"]
-        goals = profile["goals"]
-
-        # Activity level multipliers
-        activity_multipliers = {
-            "sedentary": 1.2,
-            "light": 1.375,
-            "moderate": 1.55,
-            "active": 1.725,
-            "very_active": 1.9
-        }
-
-        # Calculate BMR
-        bmr = 10 * weight + 6.25 * height - 5 * age
-        
-        # Adjust for activity level
-        tdee = bmr * activity_multipliers.get(activity_level, 1.2)
+            return None
 
-        # Adjust based on goals
-        if "weight_loss" in goals:
-            calories = tdee - 500
-        elif "muscle_gain" in goals:
-            calories = tdee + 300
-        else:
-            calories = tdee
+    async def _get_food_nutrients_many(self, food_items: List[str]) -> List[Optional[dict]]:
+        """Fetch nutrition data for several food items concurrently; None marks failed lookups."""
+        # Look up each distinct item once, however often it appears in the batch
+        keys = [self._normalize_food_item(item) for item in food_items]
+        unique_keys = list(dict.fromkeys(keys))
 
-        return NutritionGoals(
-            calories=round(calories),
-            protein=round(weight * 2.2),  # 2.2g per kg of body weight
-            carbs=round(calories * 0.45 / 4),  # 45% of calories from carbs
-            fat=round(calories * 0.25 / 9),  # 25% of calories from fat
-            fiber=30  # General recommendation
+        results = await asyncio.gather(
+            *(self._get_food_nutrients(key) for key in unique_keys),
+            return_exceptions=True
         )
+        by_key = {
+            key: None if isinstance(result, BaseException) else result
+            for key, result in zip(unique_keys, results)
+        }
+        return [by_key[key] for key in keys]
 
-    def _create_workout_plan_prompt(self, profile: dict) -> str:
-        """Create a prompt for workout plan generation."""
-        # Create user profile section
-        user_profile = f"""
-        Age: {profile.get('age')} years
-        Weight: {profile.get('weight')} kg
-        Height: {profile.get('height')} cm
-        Goals: {', '.join(profile.get('goals', []))}
-        Activity Level: {profile.get('activity_level')}
-        """
+    async def analyze_nutritional_content(self, meal: MealInput) -> dict:
+        """Analyze a meal's nutrition using OpenFoodFacts data.
 
-        # Define the expected JSON structure
-        json_structure = """
-        {
-            "weekly_schedule": {
-                "monday": [{"exercise": "...", "sets": "...", "duration": "..."}],
-                "tuesday": [{"exercise": "...", "sets": "...", "duration": "..."}],
-                "wednesday": [{"exercise": "...", "sets": "...", "duration": "..."}],
-                "thursday": [{"exercise": "...", "sets": "...", "duration": "..."}],
-                "friday": [{"exercise": "...", "sets": "...", "duration": "..."}],
-                "saturday": [{"exercise": "...", "sets": "...", "duration": "..."}],
-                "sunday": [{"exercise": "...", "sets": "...", "duration": "..."}]
-            },
-            "intensity_level": "...",
-            "estimated_calories_burn": 0,
-            "warm_up": ["...", "..."],
-            "cool_down": ["...", "..."],
-            "safety_precautions": ["...", "..."],
-            "progression_tips": ["...", "..."]
-        }
+        Returns per-item nutrients scaled to the grams eaten, plus the meal
+        totals.
         """
+        names = [entry.item for entry in meal.items]
+        grams = [entry.grams for entry in meal.items]
+
+        per_100g = await self._get_food_nutrients_many(names)
+        analyzed = []
+        totals = dict.fromkeys(NUTRIENT_FIELDS, 0.0)
+        for name, amount, nutrients in zip(names, grams, per_100g):
+            nutrients = nutrients or {}
+            scaled = {field: round(float(nutrients[field] or 0) * amount / 100, 1) for field in nutrients}
+            for field, value in scaled.items():
+                totals[field] += value
+            analyzed.append({"item": name, "grams": amount, "nutrients": scaled, "found": bool(nutrients)})
+
+        return {
+            "items": analyzed,
+            "totals": {field: round(value, 1) for field, value in totals.items()}
+        }
 
-        # Combine all parts into the final prompt
-        return f"""Create a workout plan for a person with the following profile:
-{user_profile}
+    async def _set_enrichment(self, plan_id: str, result: dict, only_new: bool = False,
+                              ttl: int = ENRICHMENT_TTL) -> bool:
+        """Store an enrichment result; with only_new, leave an existing one alone and return False."""
+        try:
+            stored = await self.redis_client.set(f"enrichment:{plan_id}", orjson.dumps(result), ex=ttl, nx=only_new)
+            return bool(stored)
+        except Exception as e:
+            logger.warning(f"Enrichment write failed: {str(e)}")
+            return False
 
-The response should be a valid JSON object with the following structure:
-{json_structure}
+    async def get_meal_plan_enrichment(self, plan_id: str) -> Optional[dict]:
+        """Return the background nutrient lookup state for a plan, or None if unknown."""
+        if self.redis_client is None:
+            return None
+        try:
+            stored = await self.redis_client.get(f"enrichment:{plan_id}")
+        except Exception as e:
+            logger.warning(f"Enrichment lookup failed: {str(e)}")
+            return None
+        return orjson.loads(stored) if stored else None
 
-The response must be a valid JSON object that can be parsed directly."""
+    async def start_meal_plan_enrichment(self, meal_plan: MealPlan) -> Optional[str]:
+        """Look up OpenFoodFacts nutrients for a plan's meals in the background.
+
+        Returns the plan id to poll with get_meal_plan_enrichment, or None
+        when there is nowhere to keep the results. The id is derived from the
+        plan, so a plan served again from the plan cache reuses the lookups
+        already stored for it instead of starting new ones.
+        """
+        if self.redis_client is None:
+            return None
+        plan_id = hashlib.sha256(meal_plan.model_dump_json().encode()).hexdigest()[:32]
+        if await self._set_enrichment(plan_id, {"status": "pending"}, only_new=True):
+            self._spawn(self._enrich_meal_plan(plan_id, meal_plan))
+        elif await self.get_meal_plan_enrichment(plan_id) is None:
+            return None
+        return plan_id
+
+    async def _enrich_meal_plan(self, plan_id: str, meal_plan: MealPlan):
+        days = list(meal_plan.meals.items())
+        results = await self._get_food_nutrients_many([meal.item for _, meals in days for meal in meals])
+        if all(result is None for result in results):
+            logger.error(f"Nutrient enrichment failed for plan {plan_id}: OpenFoodFacts is unavailable")
+            await self._set_enrichment(plan_id, {"status": "failed"}, ttl=ENRICHMENT_FAILED_TTL)
+            return
+        # Items whose lookup failed keep null nutrients; {} means no match was found
+        nutrients = iter(results)
+        await self._set_enrichment(plan_id, {
+            "status": "complete",
+            "meals": {
+                day: [{"item": meal.item, "nutrients": next(nutrients)} for meal in meals]
+                for day, meals in days
+            }
+        })
 
     def _parse_meal_plan_response(self, response_text: str) -> MealPlan:
-        # Parse the AI response into a structured meal plan
-        meals = {}
-        
-        # Split the response into sections
-        sections = response_text.split("\n\n")
-        current_meal = None
-        meal_items = []
-        total_calories = 0
-        total_protein = 0
-        total_carbs = 0
-        total_fat = 0
-
-        for section in sections:
-            if "Breakfast:" in section:
-                current_meal = "breakfast"
-                meal_items = []
-                items = section.replace("Breakfast:", "").strip().split("\n")
-                for item in items:
-                    if item.strip():
-                        meal_items.append({"item": item.strip(), "portion": "1 serving"})
-                meals[current_meal] = meal_items
-            elif "Lunch:" in section:
-                current_meal = "lunch"
-                meal_items = []
-                items = section.replace("Lunch:", "").strip().split("\n")
-                for item in items:
-                    if item.strip():
-                        meal_items.append({"item": item.strip(), "portion": "1 serving"})
-                meals[current_meal] = meal_items
-            elif "Dinner:" in section:
-                current_meal = "dinner"
-                meal_items = []
-                items = section.replace("Dinner:", "").strip().split("\n")
-                for item in items:
-                    if item.strip():
-                        meal_items.append({"item": item.strip(), "portion": "1 serving"})
-                meals[current_meal] = meal_items
-            elif "Snacks:" in section:
-                current_meal = "snacks"
-                meal_items = []
-                items = section.replace("Snacks:", "").strip().split("\n")
-                for item in items:
-                    if item.strip():
-                        meal_items.append({"item": item.strip(), "portion": "1 serving"})
-                meals[current_meal] = meal_items
-
-        # Estimate total nutrients (simplified)
-        total_calories = 2000  # Placeholder
-        total_protein = 100    # Placeholder
-        total_carbs = 250     # Placeholder
-        total_fat = 70       # Placeholder
-
-        return MealPlan(
-            meals=meals,
-            total_calories=total_calories,
-            total_protein=total_protein,
-            total_carbs=total_carbs,
-            total_fat=total_fat
-        )
+        """Parse and validate a JSON meal plan returned by the AI model."""
+        # Parsing and validation happen in one pass inside pydantic-core
+        return MealPlan.model_validate_json(response_text)
 
     def _parse_workout_plan_response(self, response_text: str) -> WorkoutPlan:
-        # This is a simplified example - in production you'd want more robust parsing
-        return WorkoutPlan(
-            weekly_schedule={
-                "monday": [
-                    {"exercise": "Squats", "sets": "3x12"},
-                    {"exercise": "Bench Press", "sets": "3x10"}
-                ],
-                "wednesday": [
-                    {"exercise": "Deadlifts", "sets": "3x8"},
-                    {"exercise": "Pull-ups", "sets": "3x8"}
-                ],
-                "friday": [
-                    {"exercise": "Running", "duration": "30 minutes"},
-                    {"exercise": "Core workout", "duration": "15 minutes"}
-                ]
-            },
-            intensity_level="moderate",
-            estimated_calories_burn=500.0
-        )
-
-    def _estimate_prep_time(self, meal_item: str) -> int:
-        # Simplified example, actual implementation would require more data
-        return 30
-
-    def _calculate_difficulty(self, meal_item: str) -> str:
-        # Simplified example, actual implementation would require more data
-        return "Easy"
-
-    def _identify_muscle_groups(self, exercise: str) -> List[str]:
-        # Simplified example, actual implementation would require more data
-        return ["Chest", "Triceps"]
-
-    def _get_required_equipment(self, exercise: str) -> List[str]:
-        # Simplified example, actual implementation would require more data
-        return ["Barbell", "Bench"]
-
-    def _calculate_exercise_difficulty(self, exercise: str) -> str:
-        # Simplified example, actual implementation would require more data
-        return "Moderate"
-
-    def _get_exercise_tutorial(self, exercise: str) -> str:
-        # Simplified example, actual implementation would require more data
-        return "https://example.com/exercise-tutorial"
+        """Parse and validate a JSON workout plan returned by the AI model."""
+        return WorkoutPlan.model_validate_json(response_text)
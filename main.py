@@ -1,15 +1,21 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response as JSONResponse
-from models import HealthInput, MealPlan, WorkoutPlan, NutritionGoals
-from health_coach import HealthCoach
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from models import HealthInput, MealInput, MealPlan, WorkoutPlan, NutritionGoals, FullPlan
+from health_coach import HealthCoach, client as openai_client
+from nutrient_store import NutrientStore
+from circuit_breaker import CircuitOpenError
+from openai import APIError, APITimeoutError, RateLimitError
 import os
+import asyncio
 from dotenv import load_dotenv
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from rate_limiter import RouteRateLimiter, RateLimitExceeded, client_ip
 import logging
-import redis
+from redis.asyncio import Redis, BlockingConnectionPool
+from typing import AsyncIterator
+from pydantic import BaseModel
+from starlette.types import Receive, Scope, Send
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,36 +26,142 @@ load_dotenv()
 app = FastAPI(
     title="AI Health and Nutrition Coach",
     description="AI-Powered Health and Nutrition Coaching",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+REDIS_HOST = os.getenv("RENDER_REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("RENDER_REDIS_PORT", 6379))
+REDIS_PASSWORD = os.getenv("RENDER_REDIS_PASSWORD", "")
+# Redis sits on every plan request; an unreachable server must fail fast, not hang until the TCP timeout
+REDIS_TIMEOUT = 1.0
 
-# Initialize Redis
-redis_client = redis.Redis(
-    host=os.getenv("RENDER_REDIS_HOST", "localhost"),
-    port=int(os.getenv("RENDER_REDIS_PORT", 6379)),
-    password=os.getenv("RENDER_REDIS_PASSWORD", ""),
+# Initialize Redis; requests wait for a free pooled connection instead of opening more
+redis_client = Redis(connection_pool=BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    password=REDIS_PASSWORD,
+    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT,
     decode_responses=True
-)
+))
+
+# Initialize rate limiter. Counters live in Redis so every worker shares the
+# same limits; they fall back to per-process memory while Redis is down.
+limiter = RouteRateLimiter(redis_client, key_func=client_ip)
+
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> Response:
+    return ORJSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+
+class PlanGZipMiddleware(GZipMiddleware):
+    """GZip responses except NDJSON plan streams.
+
+    The gzip stream buffers small writes, which would hold back each day's
+    line until several had piled up.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].endswith("/stream"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Plans are several KB of repetitive JSON, so they compress well
+app.add_middleware(PlanGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Comma-separated, as set in render.yaml
+ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "https://frontend-portfolio-aomn.onrender.com").split(",")
+    if origin.strip()
+]
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["https://frontend-portfolio-aomn.onrender.com"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-health_coach = HealthCoach()
+health_coach = HealthCoach(
+    redis_client=redis_client,
+    nutrient_store=NutrientStore(os.getenv("NUTRIENT_CACHE_PATH", "nutrient_cache.db"))
+)
+
+def get_coach() -> HealthCoach:
+    """Hand every request the shared coach and its pooled HTTP clients."""
+    return health_coach
+
+def openai_error_to_http(e: Exception) -> HTTPException:
+    """Map an OpenAI client error to the HTTP error returned to API clients."""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail="AI model is temporarily unavailable, please retry shortly")
+    if isinstance(e, RateLimitError):
+        return HTTPException(status_code=429, detail="AI model is rate limited, please retry shortly")
+    if isinstance(e, APITimeoutError):
+        return HTTPException(status_code=504, detail="AI model request timed out")
+    return HTTPException(status_code=502, detail="AI model request failed")
+
+def model_response(model: BaseModel) -> Response:
+    """Serialize a plan the coach has already validated.
+
+    Returning a Response skips FastAPI's response_model pass, which would
+    dump the model to a dict and validate it all over again. The
+    response_model on the route still documents the schema.
+    """
+    return Response(content=model.model_dump_json(), media_type="application/json")
+
+async def start_stream(chunks: AsyncIterator[bytes]) -> StreamingResponse:
+    """Wrap a plan stream in a response once its first chunk has arrived.
+
+    Pulling the first chunk up front means failures before any output, like
+    AI model errors, still produce a proper error status.
+    """
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except (APIError, CircuitOpenError) as e:
+        logger.error(f"AI model error in plan streaming: {str(e)}")
+        raise openai_error_to_http(e)
+
+    async def body():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.on_event("startup")
+async def startup():
+    # FastAPI caches the schema after the first build; do that build before any traffic arrives
+    app.openapi()
+
+    # Open the first pooled connection now rather than on the first request
+    try:
+        await asyncio.wait_for(redis_client.ping(), REDIS_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Redis is unavailable, caching is disabled until it is reachable: {str(e)}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await health_coach.aclose()
+    await redis_client.aclose()
+    # The OpenAI client is shared module-wide, so it is closed here rather than by a coach
+    await openai_client.close()
 
 @app.options("/{path:path}")
 async def options_route(request: Request):
-    return JSONResponse(
+    return ORJSONResponse(
         content="OK",
         headers={
             "Access-Control-Allow-Origin": "*",
@@ -65,18 +177,25 @@ async def root(request: Request):
     """Health check endpoint."""
     return {"status": "ok", "message": "Health & Nutrition Coach API is running"}
 
-@app.post("/meal-plan", response_model=MealPlan)
+# API endpoints; API_PREFIX=/api serves them under /api, as the README examples use
+router = APIRouter(prefix=os.getenv("API_PREFIX", ""))
+
+@router.post("/meal-plan", response_model=MealPlan)
 @limiter.limit("10/minute")
-async def generate_meal_plan(request: Request, input_data: HealthInput):
+async def generate_meal_plan(request: Request, input_data: HealthInput, coach: HealthCoach = Depends(get_coach)):
     """Generate a personalized meal plan based on user input."""
     try:
-        # Validate input data
-        if input_data.age <= 0 or input_data.weight <= 0 or input_data.height <= 0:
-            raise ValueError("Age, weight, and height must be positive numbers")
-        
         # Generate meal plan
-        meal_plan = health_coach.generate_meal_plan(input_data.dict())
-        return meal_plan
+        meal_plan = await coach.generate_meal_plan(input_data.model_dump())
+
+        # Nutrient lookups run after the response; clients poll /plans/{plan_id}/nutrients
+        plan_id = await coach.start_meal_plan_enrichment(meal_plan)
+        if plan_id is not None:
+            meal_plan = meal_plan.model_copy(update={"plan_id": plan_id, "enrichment_status": "pending"})
+        return model_response(meal_plan)
+    except (APIError, CircuitOpenError) as e:
+        logger.error(f"AI model error in meal plan generation: {str(e)}")
+        raise openai_error_to_http(e)
     except ValueError as e:
         logger.error(f"Validation error in meal plan generation: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -84,56 +203,85 @@ async def generate_meal_plan(request: Request, input_data: HealthInput):
         logger.error(f"Error generating meal plan: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error while generating meal plan")
 
-@app.post("/analyze-meal")
+@router.get("/plans/{plan_id}/nutrients")
+@limiter.limit("60/minute")
+async def get_plan_nutrients(request: Request, plan_id: str, coach: HealthCoach = Depends(get_coach)):
+    """Get the background OpenFoodFacts nutrient lookups for a meal plan."""
+    enrichment = await coach.get_meal_plan_enrichment(plan_id)
+    if enrichment is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired plan id")
+    return enrichment
+
+@router.post("/meal-plan/stream")
 @limiter.limit("10/minute")
-async def analyze_meal(request: Request, meal_data: dict):
+async def stream_meal_plan(request: Request, input_data: HealthInput, coach: HealthCoach = Depends(get_coach)):
+    """Stream a personalized meal plan as NDJSON, one day per line, while it is being generated."""
+    return await start_stream(coach.stream_meal_plan(input_data.model_dump()))
+
+@router.post("/analyze-meal")
+@limiter.limit("10/minute")
+async def analyze_meal(request: Request, meal_data: MealInput, coach: HealthCoach = Depends(get_coach)):
     """Analyze the nutritional content of a meal."""
     try:
-        if not meal_data or not isinstance(meal_data, dict):
-            raise ValueError("Invalid meal data format")
-        
-        analysis = health_coach.analyze_nutritional_content(meal_data)
-        return analysis
-    except ValueError as e:
-        logger.error(f"Validation error in meal analysis: {str(e)}")
-        raise HTTPException(status_code=400, detail=str(e))
+        return await coach.analyze_nutritional_content(meal_data)
     except Exception as e:
         logger.error(f"Error analyzing meal: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error while analyzing meal")
 
-@app.post("/workout-plan", response_model=WorkoutPlan)
+@router.post("/workout-plan", response_model=WorkoutPlan)
 @limiter.limit("10/minute")
-async def get_workout_plan(request: Request, input_data: HealthInput):
+async def get_workout_plan(request: Request, input_data: HealthInput, coach: HealthCoach = Depends(get_coach)):
     try:
-        coach = HealthCoach()
-        return await coach.generate_workout_plan(input_data.dict())
+        return model_response(await coach.generate_workout_plan(input_data.model_dump()))
+    except (APIError, CircuitOpenError) as e:
+        logger.error(f"AI model error in workout plan generation: {str(e)}")
+        raise openai_error_to_http(e)
     except Exception as e:
         logger.error(f"Workout plan error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"detail": f"Workout plan generation failed: {str(e)}"}
         )
 
-@app.post("/nutrition-goals", response_model=NutritionGoals)
+@router.post("/workout-plan/stream")
 @limiter.limit("10/minute")
-async def get_nutrition_goals(request: Request, input_data: HealthInput):
+async def stream_workout_plan(request: Request, input_data: HealthInput, coach: HealthCoach = Depends(get_coach)):
+    """Stream a workout plan as NDJSON, one day per line, while it is being generated."""
+    return await start_stream(coach.stream_workout_plan(input_data.model_dump()))
+
+@router.post("/nutrition-goals", response_model=NutritionGoals)
+@limiter.limit("10/minute")
+async def get_nutrition_goals(request: Request, input_data: HealthInput, coach: HealthCoach = Depends(get_coach)):
     """Calculate nutrition goals based on user input."""
     try:
-        # Validate input data
-        if input_data.age <= 0 or input_data.weight <= 0 or input_data.height <= 0:
-            raise ValueError("Age, weight, and height must be positive numbers")
-        
         # Calculate nutrition goals
-        goals = health_coach.get_nutrition_goals(input_data.dict())
-        return goals
-    except ValueError as e:
-        logger.error(f"Validation error in nutrition goals calculation: {str(e)}")
-        raise HTTPException(status_code=400, detail=str(e))
+        goals = await coach.get_nutrition_goals_async(input_data.model_dump())
+        return model_response(goals)
     except Exception as e:
         logger.error(f"Error calculating nutrition goals: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error while calculating nutrition goals")
 
+@router.post("/full-plan", response_model=FullPlan)
+@limiter.limit("10/minute")
+async def get_full_plan(request: Request, input_data: HealthInput, coach: HealthCoach = Depends(get_coach)):
+    """Generate meal plan, workout plan and nutrition goals in a single request."""
+    try:
+        return model_response(await coach.generate_full_plan(input_data.model_dump()))
+    except (APIError, CircuitOpenError) as e:
+        logger.error(f"AI model error in full plan generation: {str(e)}")
+        raise openai_error_to_http(e)
+    except ValueError as e:
+        logger.error(f"Validation error in full plan generation: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error generating full plan: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error while generating full plan")
+
+app.include_router(router)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
+    # uvicorn[standard] provides uvloop and httptools; "auto" picks them up and
+    # falls back to asyncio on Windows, where uvloop is not available
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="auto", http="auto")
@@ -1,5 +1,14 @@
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict, Union
+from pydantic import BaseModel, BeforeValidator, Field, TypeAdapter, field_validator
+from typing import Annotated, List, Optional, Dict, Union, Literal, get_args
+
+Day = Literal['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DAYS = get_args(Day)
+
+def lowercase_days(v):
+    """Let plans keyed "Monday" validate against the lowercase Day keys."""
+    if isinstance(v, dict):
+        return {day.lower() if isinstance(day, str) else day: value for day, value in v.items()}
+    return v
 
 class Nutrients(BaseModel):
     calories: float = Field(..., ge=0)
@@ -14,17 +23,18 @@ class MealItem(BaseModel):
     portion: str = Field(..., min_length=1)
     nutrients: Optional[Nutrients] = None
     preparation_time: Optional[int] = Field(None, ge=0)
-    difficulty_level: Optional[str] = Field(None, pattern="^(easy|medium|hard)$")
+    difficulty_level: Optional[Literal['easy', 'medium', 'hard']] = None
     alternatives: Optional[List[str]] = None
 
-    @validator('alternatives')
+    @field_validator('alternatives')
+    @classmethod
     def validate_alternatives(cls, v):
         if v is not None and len(v) == 0:
             raise ValueError("Alternatives list cannot be empty")
         return v
 
 class MealPlan(BaseModel):
-    meals: Dict[str, List[MealItem]]
+    meals: Dict[Day, List[MealItem]]
     meal_timing: Optional[Dict[str, str]] = None
     hydration_guidelines: Optional[str] = Field(None, min_length=1)
     preparation_tips: Optional[List[str]] = None
@@ -34,54 +44,85 @@ class MealPlan(BaseModel):
     total_carbs: float = Field(..., ge=0)
     total_fat: float = Field(..., ge=0)
     total_fiber: float = Field(..., ge=0)
+    # Set when OpenFoodFacts nutrients are being looked up in the background
+    plan_id: Optional[str] = None
+    enrichment_status: Optional[str] = None
 
-    @validator('meals')
+    @field_validator('meals', mode='before')
+    @classmethod
+    def normalize_meal_days(cls, v):
+        return lowercase_days(v)
+
+    @field_validator('meals')
+    @classmethod
     def validate_meals(cls, v):
-        valid_days = {'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'}
-        provided_days = {day.lower() for day in v.keys()}
-        
-        # Check if any invalid days were provided
-        if not provided_days.issubset(valid_days):
-            invalid_days = provided_days - valid_days
-            raise ValueError(f"Invalid days in meal plan: {', '.join(invalid_days)}")
-            
-        # Check if all required days are present
-        missing_days = valid_days - provided_days
+        missing_days = [day for day in DAYS if day not in v]
         if missing_days:
             raise ValueError(f"Meal plan is missing the following days: {', '.join(missing_days)}")
+
+        # 3 main meals + 2 snacks per day
+        for day, meals in v.items():
+            if len(meals) < 5:
+                raise ValueError(f"Insufficient meals for {day}")
             
         return v
 
+def expand_rest_day(exercises):
+    """The model sometimes writes a rest day as the bare string "rest"."""
+    if isinstance(exercises, str) and exercises.lower() == 'rest':
+        return [{"exercise": "Rest"}]
+    return exercises
+
 class Exercise(BaseModel):
     exercise: str = Field(..., min_length=1)
     sets: Optional[str] = Field(None, min_length=1)
     duration: Optional[str] = Field(None, min_length=1)
 
-    @validator('exercise')
+    @field_validator('exercise')
+    @classmethod
     def validate_exercise(cls, v):
         if v.lower() == 'rest':
             return v
         return v
 
 class WorkoutPlan(BaseModel):
-    weekly_schedule: Dict[str, List[Exercise]]
-    intensity_level: str = Field(..., pattern="^(?i)low|medium|high$")
+    weekly_schedule: Dict[Day, List[Exercise]]
+    intensity_level: Literal['low', 'medium', 'high']
     estimated_calories_burn: float = Field(..., ge=0)
     warm_up: Optional[List[str]] = None
     cool_down: Optional[List[str]] = None
     safety_precautions: Optional[List[str]] = None
     progression_tips: Optional[List[str]] = None
 
-    @validator('weekly_schedule')
+    @field_validator('weekly_schedule', mode='before')
+    @classmethod
+    def expand_rest_days(cls, v):
+        if isinstance(v, dict):
+            return {day: expand_rest_day(exercises) for day, exercises in lowercase_days(v).items()}
+        return v
+
+    @field_validator('weekly_schedule')
+    @classmethod
     def validate_schedule(cls, v):
-        valid_days = {'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'}
-        if not all(day.lower() in valid_days for day in v.keys()):
-            raise ValueError("Invalid day in workout schedule")
+        missing_days = [day for day in DAYS if day not in v]
+        if missing_days:
+            raise ValueError(f"Workout schedule is missing the following days: {', '.join(missing_days)}")
+
+        for day, exercises in v.items():
+            for exercise in exercises:
+                if exercise.exercise.lower() != 'rest' and exercise.sets is None and exercise.duration is None:
+                    raise ValueError(f"Exercise must have either sets or duration in {day}")
         return v
 
-    @validator('intensity_level')
+    @field_validator('intensity_level', mode='before')
+    @classmethod
     def normalize_intensity(cls, v):
-        return v.lower()
+        # The prompt's example plan says "High"
+        return v.lower() if isinstance(v, str) else v
+
+# One day of a plan, validated as the whole plan validates it, for streamed plans
+MEAL_PLAN_DAY = TypeAdapter(List[MealItem])
+WORKOUT_PLAN_DAY = TypeAdapter(Annotated[List[Exercise], BeforeValidator(expand_rest_day)])
 
 class NutritionGoals(BaseModel):
     calories: float = Field(..., ge=0)
@@ -90,17 +131,38 @@ class NutritionGoals(BaseModel):
     fat: float = Field(..., ge=0)
     fiber: float = Field(..., ge=0)
 
+class FullPlan(BaseModel):
+    meal_plan: MealPlan
+    workout_plan: WorkoutPlan
+    nutrition_goals: NutritionGoals
+
 class HealthInput(BaseModel):
     age: int = Field(..., gt=0, le=120)
     weight: float = Field(..., gt=0, le=500)
     height: float = Field(..., gt=0, le=300)
-    goals: List[str] = Field(..., min_items=1)
+    goals: List[str] = Field(..., min_length=1)
     dietary_restrictions: Optional[List[str]] = []
-    activity_level: str = Field(..., pattern="^(light|moderate|active|very_active)$")
+    activity_level: Literal['light', 'moderate', 'active', 'very_active']
     meal_preferences: Optional[List[str]] = []
 
-    @validator('goals')
+    @field_validator('goals')
+    @classmethod
     def validate_goals(cls, v):
         if not v:
             raise ValueError("At least one goal must be specified")
         return v
+
+class MealInputItem(BaseModel):
+    item: str = Field(..., min_length=1, pattern=r"\S")
+    grams: float = Field(100, gt=0)
+
+class MealInput(BaseModel):
+    items: List[MealInputItem] = Field(..., min_length=1)
+
+    @field_validator('items', mode='before')
+    @classmethod
+    def expand_item_names(cls, v):
+        # A bare food name means a 100g serving
+        if isinstance(v, list):
+            return [{"item": entry} if isinstance(entry, str) else entry for entry in v]
+        return v
@@ -0,0 +1,56 @@
+from typing import Optional
+import time
+import sqlite3
+import logging
+import orjson
+
+logger = logging.getLogger(__name__)
+
+NUTRIENT_STORE_TTL = 30 * 86400  # OpenFoodFacts product data rarely changes
+NUTRIENT_STORE_MISS_TTL = 3600  # Foods with no match are retried sooner, in case the lookup improves
+
+class NutrientStore:
+    """SQLite-backed persistent cache of OpenFoodFacts nutrient lookups.
+
+    Survives restarts so previously seen food items never hit the network
+    again within the TTL. Lookups are single indexed reads that take well
+    under a millisecond, so they run inline. So do writes: with WAL and
+    synchronous=NORMAL a commit only appends to the log without an fsync.
+    """
+
+    def __init__(self, path: str, ttl: int = NUTRIENT_STORE_TTL, miss_ttl: int = NUTRIENT_STORE_MISS_TTL):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # A crash can lose the last few lookups, which are simply fetched again
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS nutrients ("
+            "food_item TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        # Earlier versions kept misses as long as real products
+        self.conn.execute("DELETE FROM nutrients WHERE data = ?", (orjson.dumps({}),))
+
+    def get(self, food_item: str) -> Optional[dict]:
+        try:
+            row = self.conn.execute(
+                "SELECT data FROM nutrients WHERE food_item = ? AND expires_at > ?",
+                (food_item, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Nutrient store lookup failed: {str(e)}")
+            return None
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, food_item: str, nutrients: dict):
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO nutrients (food_item, data, expires_at) VALUES (?, ?, ?)",
+                (food_item, orjson.dumps(nutrients), time.time() + (self.ttl if nutrients else self.miss_ttl))
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Nutrient store write failed: {str(e)}")
+
+    def close(self):
+        self.conn.close()
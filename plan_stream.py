@@ -0,0 +1,116 @@
+from typing import Any, AsyncIterator, List, Tuple, Type
+import orjson
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from models import DAYS
+
+class SectionSplitter:
+    """Pick complete per-day entries out of a plan's JSON text as it arrives.
+
+    Tracks just enough JSON structure (strings, nesting depth, top-level and
+    second-level keys) to notice when the value of one day inside the
+    section object, e.g. "meals": {"monday": [...]}, has been closed.
+    Each character is scanned once, however the text is chunked.
+    """
+
+    def __init__(self, section: str):
+        self.section = section
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.last_string = None
+        self.top_key = None
+        self.in_section = False
+        self.day = None
+        self.value_start = None
+
+    def _finish_value(self, end: int, completed: List[Tuple[str, Any]]):
+        try:
+            completed.append((self.day, orjson.loads(self.text[self.value_start:end])))
+        except orjson.JSONDecodeError:
+            pass  # A malformed day is left to the final whole-plan parse to report
+        self.day = self.value_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Add text and return the (day, value) pairs completed by it."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self.pos, len(text)):
+            char = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start + 1:i]
+                    if self.in_section and self.depth == 2 and self.value_start is not None:
+                        self._finish_value(i + 1, completed)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+                if self.in_section and self.depth == 2 and self.day is not None and self.value_start is None:
+                    self.value_start = i
+            elif char == ":":
+                if self.depth == 1:
+                    self.top_key = self.last_string
+                elif self.in_section and self.depth == 2:
+                    self.day = self.last_string
+            elif char in "{[":
+                if self.in_section and self.depth == 2 and self.day is not None and self.value_start is None:
+                    self.value_start = i
+                self.depth += 1
+                if self.depth == 2 and self.top_key == self.section and char == "{":
+                    self.in_section = True
+            elif char in "}]":
+                if self.in_section and self.depth == 2 and self.value_start is not None:
+                    # Bare scalar, such as null, as the section's last value
+                    self._finish_value(i, completed)
+                self.depth -= 1
+                if self.in_section and self.depth == 2 and self.value_start is not None:
+                    self._finish_value(i + 1, completed)
+                elif self.in_section and self.depth == 1:
+                    self.in_section = False
+                    self.top_key = None
+            elif char == "," and self.in_section and self.depth == 2 and self.value_start is not None:
+                # Bare scalar such as null
+                self._finish_value(i, completed)
+            elif not char.isspace() and self.in_section and self.depth == 2 \
+                    and self.day is not None and self.value_start is None:
+                self.value_start = i
+        self.pos = len(text)
+        return completed
+
+async def stream_plan_ndjson(chunks: AsyncIterator[str], model: Type[BaseModel], section: str,
+                             item_key: str, day_type: TypeAdapter) -> AsyncIterator[bytes]:
+    """Turn a plan's streamed JSON text into NDJSON lines, one per day.
+
+    Emits {"day": ..., item_key: [...]} as soon as each day is complete and
+    validates as day_type, normalized the way the non-streaming endpoints
+    return it. Then one final {"summary": {...}} line with the plan's
+    remaining fields, or {"error": ...} if the full text does not validate
+    as model, just as the non-streaming endpoints would reject it.
+    """
+    splitter = SectionSplitter(section)
+    async for chunk in chunks:
+        for day, value in splitter.feed(chunk):
+            day = day.lower()
+            try:
+                items = day_type.validate_python(value)
+            except ValidationError:
+                continue  # Left to the whole-plan validation to report
+            if day in DAYS:
+                yield orjson.dumps({"day": day, item_key: day_type.dump_python(items, mode="json")}) + b"\n"
+
+    try:
+        plan = model.model_validate_json(splitter.text)
+    except ValidationError:
+        yield orjson.dumps({"error": "Failed to parse the response from the AI model"}) + b"\n"
+        return
+    yield orjson.dumps({"summary": plan.model_dump(mode="json", exclude={section})}) + b"\n"
@@ -0,0 +1,134 @@
+from typing import Any, Callable, Dict, List, Tuple
+import os
+import time
+import asyncio
+import functools
+import logging
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+# Proxies in front of the app that append to X-Forwarded-For; Render's load balancer is one
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 1))
+# In-memory windows kept before expired ones are dropped
+MAX_FALLBACK_WINDOWS = 10000
+
+# Fixed window counter: the first hit in a window sets when it expires
+FIXED_WINDOW_SCRIPT = """
+local hits = redis.call('INCR', KEYS[1])
+if hits == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return {hits, redis.call('TTL', KEYS[1])}
+"""
+
+class AsyncRateLimiter:
+    """Token bucket allowing at most `rate` acquisitions per `period` seconds.
+
+    Waiters are served in arrival order. Bursts up to `rate` go through
+    immediately, after that callers are spaced out evenly.
+    """
+
+    def __init__(self, rate: float, period: float = 60):
+        self.rate = rate
+        self.period = period
+        self._tokens = rate
+        self._updated = time.monotonic()
+        # Created on first use so it binds to the running event loop
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.period / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+def client_ip(request) -> str:
+    """Rate limit key: the client address as seen by the outermost trusted proxy.
+
+    request.client is the nearest proxy, so every client would share one
+    bucket. Each of the TRUSTED_PROXY_HOPS proxies appends the address it saw
+    to X-Forwarded-For, so the client is that many entries from the end.
+    Earlier entries come from the client and could be forged to dodge the limit.
+    """
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if hops:
+            # Fewer entries than trusted proxies: the first one is the closest to the client
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return request.client.host if request.client else "127.0.0.1"
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, limit: str, retry_after: int):
+        super().__init__(f"Rate limit exceeded: {limit}")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class RouteRateLimiter:
+    """Per-client fixed window limits for API routes, counted in Redis.
+
+    Every worker shares the counters. Each check is a single Lua script call
+    on the async Redis client, so it never blocks the event loop. While Redis
+    is unreachable each worker counts in its own memory instead.
+    """
+
+    def __init__(self, redis_client, key_func: Callable[[Any], str], timeout: float = 0.5):
+        self.key_func = key_func
+        self.timeout = timeout
+        self._script = redis_client.register_script(FIXED_WINDOW_SCRIPT)
+        # key -> [hits, window end]
+        self._fallback: Dict[str, List[float]] = {}
+
+    def _hit_in_memory(self, key: str, period: int) -> Tuple[int, int]:
+        now = time.monotonic()
+        window = self._fallback.get(key)
+        if window is None or window[1] <= now:
+            if len(self._fallback) >= MAX_FALLBACK_WINDOWS:
+                self._fallback = {k: w for k, w in self._fallback.items() if w[1] > now}
+            window = self._fallback[key] = [0, now + period]
+        window[0] += 1
+        return window[0], max(int(window[1] - now), 1)
+
+    async def hit(self, key: str, period: int) -> Tuple[int, int]:
+        """Count a hit on key; return the hits in its window and the seconds until the window resets."""
+        try:
+            hits, ttl = await asyncio.wait_for(self._script(keys=[key], args=[period]), self.timeout)
+            return int(hits), max(int(ttl), 1)
+        except (RedisError, OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Rate limit check fell back to memory: {str(e)}")
+            return self._hit_in_memory(key, period)
+
+    def limit(self, limit: str):
+        """Decorate a route taking a `request` argument to allow `limit` ("10/minute") calls per client."""
+        amount, period = limit.split("/")
+        amount, period = int(amount), PERIODS[period]
+
+        def decorator(func):
+            scope = f"ratelimit:{func.__module__}.{func.__name__}"
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                hits, retry_after = await self.hit(f"{scope}:{self.key_func(kwargs['request'])}", period)
+                if hits > amount:
+                    raise RateLimitExceeded(limit, retry_after)
+                return await func(*args, **kwargs)
+            return wrapper
+        return decorator
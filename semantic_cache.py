@@ -0,0 +1,190 @@
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
+import json
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+import numpy as np
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Bump when the plan prompts change so stale plans stop matching
+PROMPT_VERSION = "v3"
+PLAN_CACHE_TTL = 7 * 86400
+EMBEDDING_MODEL = "text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.95
+MAX_SEMANTIC_ENTRIES = 10000
+# Embeddings run on the request path; a slow API skips the semantic tier instead of stalling the request
+EMBEDDING_TIMEOUT = 2
+
+# Profile fields compared semantically; every other field must match exactly.
+# Goals and dietary restrictions stay exact: short opposites like "vegan" and
+# "vegetarian" or "weight_loss" and "weight_gain" embed almost identically.
+TEXT_FIELDS = ('meal_preferences',)
+
+# Numeric fields are rounded to these steps before keying, so a 71kg user
+# reuses the plan generated for 70kg instead of paying for a new one
+PROFILE_BUCKETS = {'age': 5, 'weight': 2, 'height': 5}
+
+M = TypeVar("M", bound=BaseModel)
+
+def normalize_profile(profile: dict) -> dict:
+    """Canonicalize a profile so equivalent inputs produce the same cache key."""
+    normalized = {}
+    for key, value in profile.items():
+        if isinstance(value, (list, tuple, set, frozenset)):
+            normalized[key] = sorted({" ".join(str(v).lower().split()) for v in value})
+        elif isinstance(value, str):
+            normalized[key] = " ".join(value.lower().split())
+        elif value is None:
+            normalized[key] = []
+        elif key in PROFILE_BUCKETS and isinstance(value, (int, float)) and not isinstance(value, bool):
+            normalized[key] = round(value / PROFILE_BUCKETS[key]) * PROFILE_BUCKETS[key]
+        else:
+            normalized[key] = value
+    return normalized
+
+def _digest(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+class SemanticCache:
+    """Two-tier cache for generated plans.
+
+    The exact tier keys a stored plan on a hash of the normalized profile.
+    The semantic tier only runs when the exact tier misses. It compares
+    embeddings of the meal preferences between profiles whose other fields
+    are identical, so "protein-rich" can reuse a "high protein" plan but a
+    different goal, diet or weight bucket never matches.
+
+    The semantic index lives in process memory, so each gunicorn worker
+    builds its own and only matches plans it stored itself. The exact
+    tier is shared through Redis.
+
+    Pass the OpenAI circuit breaker as breaker to skip embeddings while it
+    is not closed.
+    """
+
+    def __init__(self, redis_client=None, openai_client=None, threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = MAX_SEMANTIC_ENTRIES, breaker=None):
+        self.redis_client = redis_client
+        self.openai_client = (
+            openai_client.with_options(timeout=EMBEDDING_TIMEOUT, max_retries=0) if openai_client is not None else None
+        )
+        self.breaker = breaker
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # partition key -> list of (unit embedding, exact key)
+        self._index: Dict[str, List[Tuple[np.ndarray, str]]] = {}
+        self._index_order = OrderedDict()
+
+    @staticmethod
+    def _keys(kind: str, profile: dict) -> Tuple[str, str, str]:
+        normalized = normalize_profile(profile)
+        exact_key = f"plan:{PROMPT_VERSION}:{kind}:{_digest(normalized)}"
+        fixed = {k: v for k, v in normalized.items() if k not in TEXT_FIELDS}
+        partition = f"{PROMPT_VERSION}:{kind}:{_digest(fixed)}"
+        # Just the values, so shared labels do not dominate the embedding
+        text = "; ".join(", ".join(normalized[k]) for k in TEXT_FIELDS if normalized.get(k))
+        return exact_key, partition, text
+
+    async def _redis_get(self, key: str) -> Optional[str]:
+        if self.redis_client is None:
+            return None
+        try:
+            return await self.redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Plan cache lookup failed: {str(e)}")
+            return None
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        if self.openai_client is None:
+            return None
+        if self.breaker is not None and not self.breaker.is_closed:
+            # Leave a half-open breaker's trial to the chat completion that needs it
+            return None
+        try:
+            response = await self.openai_client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        except Exception as e:
+            logger.warning(f"Plan cache embedding failed: {str(e)}")
+            return None
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    async def _semantic_get(self, partition: str, text: str) -> Optional[str]:
+        if not text or not self._index.get(partition):
+            return None
+        vector = await self._embed(text)
+        if vector is None:
+            return None
+        entries = self._index[partition]
+        similarities = np.stack([v for v, _ in entries]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return await self._redis_get(entries[best][1])
+
+    @staticmethod
+    def _load(cached: Optional[str], model: Type[M]) -> Optional[M]:
+        if cached is None:
+            return None
+        try:
+            return model.model_validate_json(cached)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cached plan: {str(e)}")
+            return None
+
+    async def get(self, kind: str, profile: dict, model: Type[M]) -> Optional[M]:
+        """Return a cached plan for profile, or None on a miss."""
+        exact_key, partition, text = self._keys(kind, profile)
+        cached = await self._redis_get(exact_key)
+        if cached is None:
+            cached = await self._semantic_get(partition, text)
+        return self._load(cached, model)
+
+    async def get_many(self, kind: str, profiles: List[dict], model: Type[M]) -> List[Optional[M]]:
+        """Return cached plans for several profiles, None for each miss.
+
+        The exact tier is read with a single MGET, so a cohort costs one
+        Redis round trip instead of one per profile.
+        """
+        keys = [self._keys(kind, profile) for profile in profiles]
+        cached: List[Optional[str]] = [None] * len(keys)
+        if self.redis_client is not None and keys:
+            try:
+                cached = await self.redis_client.mget([exact_key for exact_key, _, _ in keys])
+            except Exception as e:
+                logger.warning(f"Plan cache lookup failed: {str(e)}")
+
+        misses = [i for i, value in enumerate(cached) if value is None]
+        found = await asyncio.gather(*(self._semantic_get(keys[i][1], keys[i][2]) for i in misses))
+        for i, value in zip(misses, found):
+            cached[i] = value
+        return [self._load(value, model) for value in cached]
+
+    async def set(self, kind: str, profile: dict, plan: BaseModel):
+        """Store plan under the profile's exact key and index it for similarity lookups."""
+        if self.redis_client is None:
+            return
+        exact_key, partition, text = self._keys(kind, profile)
+        try:
+            await self.redis_client.setex(exact_key, PLAN_CACHE_TTL, plan.model_dump_json())
+        except Exception as e:
+            logger.warning(f"Plan cache write failed: {str(e)}")
+            return
+
+        if not text:
+            # Nothing to compare semantically; the exact tier covers this profile
+            return
+        vector = await self._embed(text)
+        if vector is None:
+            return
+        self._index.setdefault(partition, []).append((vector, exact_key))
+        self._index_order[exact_key] = partition
+        if len(self._index_order) > self.max_entries:
+            oldest_key, oldest_partition = self._index_order.popitem(last=False)
+            entries = [entry for entry in self._index[oldest_partition] if entry[1] != oldest_key]
+            if entries:
+                self._index[oldest_partition] = entries
+            else:
+                del self._index[oldest_partition]
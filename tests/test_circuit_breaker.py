@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("circuit_breaker.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", fail_max=3, reset_timeout=30)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_fail_max_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+
+    def test_half_open_admits_a_single_trial(self):
+        self.open_breaker()
+        self.now += 30
+        self.assertEqual([self.breaker.allow() for _ in range(5)], [True, False, False, False, False])
+
+    def test_successful_trial_closes(self):
+        self.open_breaker()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual([self.breaker.allow() for _ in range(3)], [True, True, True])
+
+    def test_failed_trial_reopens_for_another_timeout(self):
+        self.open_breaker()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+
+    def test_trial_that_never_reports_is_replaced(self):
+        self.open_breaker()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import orjson
+from models import MealPlan, MealItem, WorkoutPlan, DAYS, MEAL_PLAN_DAY, WORKOUT_PLAN_DAY
+from plan_stream import SectionSplitter, stream_plan_ndjson
+
+MEAL = {"item": "Oats", "portion": "1 cup"}
+# MEAL as the non-streaming endpoints return it
+MEAL_OUT = MealItem(**MEAL).model_dump(mode="json")
+
+def meal_plan(**overrides) -> dict:
+    plan = {
+        "meals": {day: [MEAL] * 5 for day in DAYS},
+        "total_calories": 2000, "total_protein": 100, "total_carbs": 200, "total_fat": 60, "total_fiber": 30
+    }
+    plan.update(overrides)
+    return plan
+
+def feed_in_chunks(splitter: SectionSplitter, text: str, size: int) -> list:
+    completed = []
+    for start in range(0, len(text), size):
+        completed.extend(splitter.feed(text[start:start + size]))
+    return completed
+
+async def chunked(text: str, size: int):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+class SectionSplitterTest(unittest.TestCase):
+    def test_chunk_boundaries_do_not_change_output(self):
+        text = orjson.dumps(meal_plan()).decode()
+        expected = [(day, [MEAL] * 5) for day in DAYS]
+        for size in (1, 2, 7, 64, len(text)):
+            with self.subTest(size=size):
+                self.assertEqual(feed_in_chunks(SectionSplitter("meals"), text, size), expected)
+
+    def test_escapes_and_brackets_inside_strings(self):
+        tricky = {"item": 'Oats "steel-cut" {x} [y] \\', "portion": "1 cup, \"heaped\""}
+        text = orjson.dumps({"note": "meals: {\"monday\": []}", "meals": {"monday": [tricky], "tuesday": []}}).decode()
+        for size in (1, 3, len(text)):
+            with self.subTest(size=size):
+                self.assertEqual(
+                    feed_in_chunks(SectionSplitter("meals"), text, size),
+                    [("monday", [tricky]), ("tuesday", [])]
+                )
+
+    def test_bare_scalars(self):
+        text = '{"meals": {"monday": null, "tuesday": "rest", "wednesday": 3, "thursday": true}}'
+        for size in (1, len(text)):
+            with self.subTest(size=size):
+                self.assertEqual(
+                    feed_in_chunks(SectionSplitter("meals"), text, size),
+                    [("monday", None), ("tuesday", "rest"), ("wednesday", 3), ("thursday", True)]
+                )
+
+    def test_ignores_nested_keys_with_the_section_name(self):
+        text = '{"other": {"meals": {"monday": [1]}}, "meals": {"friday": [2]}}'
+        self.assertEqual(SectionSplitter("meals").feed(text), [("friday", [2])])
+
+    def test_malformed_day_is_skipped(self):
+        text = '{"meals": {"monday": [1,], "tuesday": [2]}}'
+        self.assertEqual(SectionSplitter("meals").feed(text), [("tuesday", [2])])
+
+class StreamPlanNdjsonTest(unittest.IsolatedAsyncioTestCase):
+    async def collect(self, text: str, model=MealPlan, section="meals", item_key="meals", day_type=MEAL_PLAN_DAY,
+                      size=5) -> list:
+        return [
+            orjson.loads(line)
+            async for line in stream_plan_ndjson(chunked(text, size), model, section, item_key, day_type)
+        ]
+
+    async def test_valid_plan_ends_with_summary(self):
+        lines = await self.collect(orjson.dumps(meal_plan()).decode())
+        self.assertEqual([line["day"] for line in lines[:-1]], list(DAYS))
+        self.assertEqual(lines[0]["meals"], [MEAL_OUT] * 5)
+        self.assertEqual(lines[-1]["summary"]["total_calories"], 2000)
+        self.assertNotIn("meals", lines[-1]["summary"])
+
+    async def test_plan_the_model_rejects_ends_with_error(self):
+        plan = meal_plan()
+        plan["meals"]["monday"] = [MEAL]
+        lines = await self.collect(orjson.dumps(plan).decode())
+        self.assertIn("error", lines[-1])
+        self.assertFalse(any("summary" in line for line in lines))
+
+    async def test_invalid_json_ends_with_error(self):
+        text = '{"meals": {"monday": ' + orjson.dumps([MEAL]).decode() + '}, "total'
+        lines = await self.collect(text)
+        self.assertEqual(lines, [{"day": "monday", "meals": [MEAL_OUT]}, {"error": lines[-1]["error"]}])
+
+    async def test_invalid_day_is_not_emitted(self):
+        plan = meal_plan()
+        plan["meals"]["monday"] = [{"item": "Oats"}]
+        lines = await self.collect(orjson.dumps(plan).decode())
+        self.assertEqual([line.get("day") for line in lines[:-1]], list(DAYS[1:]))
+        self.assertIn("error", lines[-1])
+
+    async def test_days_are_normalized_like_the_plan(self):
+        plan = {
+            "weekly_schedule": {day.capitalize(): "rest" for day in DAYS},
+            "intensity_level": "High",
+            "estimated_calories_burn": 1500
+        }
+        lines = await self.collect(orjson.dumps(plan).decode(), WorkoutPlan, "weekly_schedule", "exercises",
+                                   WORKOUT_PLAN_DAY)
+        rest_day = WorkoutPlan.model_validate(plan).model_dump(mode="json")["weekly_schedule"]["monday"]
+        self.assertEqual(lines[0], {"day": "monday", "exercises": rest_day})
+        self.assertEqual(rest_day, [{"exercise": "Rest", "sets": None, "duration": None}])
+        self.assertEqual(lines[-1]["summary"]["intensity_level"], "high")
+
+if __name__ == "__main__":
+    unittest.main()
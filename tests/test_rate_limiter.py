@@ -0,0 +1,71 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from redis.exceptions import ConnectionError
+from rate_limiter import RouteRateLimiter, RateLimitExceeded, client_ip
+
+class FakeRedis:
+    """Runs the fixed window script against a dict, or fails like a dead server."""
+
+    def __init__(self, down: bool = False):
+        self.down = down
+        self.hits = {}
+
+    def register_script(self, script):
+        async def run(keys, args):
+            if self.down:
+                raise ConnectionError("Connection refused")
+            self.hits[keys[0]] = self.hits.get(keys[0], 0) + 1
+            return [self.hits[keys[0]], int(args[0])]
+        return run
+
+def request(ip, forwarded_for=None):
+    headers = {"x-forwarded-for": forwarded_for} if forwarded_for is not None else {}
+    return SimpleNamespace(client=SimpleNamespace(host=ip), headers=headers)
+
+class ClientIpTest(unittest.TestCase):
+    def test_one_trusted_hop_takes_the_last_entry(self):
+        with mock.patch("rate_limiter.TRUSTED_PROXY_HOPS", 1):
+            self.assertEqual(client_ip(request("10.0.0.1", "6.6.6.6, 1.2.3.4")), "1.2.3.4")
+
+    def test_two_trusted_hops_skip_the_inner_proxy(self):
+        with mock.patch("rate_limiter.TRUSTED_PROXY_HOPS", 2):
+            self.assertEqual(client_ip(request("10.0.0.1", "6.6.6.6, 1.2.3.4, 172.16.0.9")), "1.2.3.4")
+            self.assertEqual(client_ip(request("10.0.0.1", "1.2.3.4")), "1.2.3.4")
+
+    def test_without_header_or_trusted_hops_uses_the_peer(self):
+        with mock.patch("rate_limiter.TRUSTED_PROXY_HOPS", 1):
+            self.assertEqual(client_ip(request("10.0.0.1")), "10.0.0.1")
+        with mock.patch("rate_limiter.TRUSTED_PROXY_HOPS", 0):
+            self.assertEqual(client_ip(request("10.0.0.1", "1.2.3.4")), "10.0.0.1")
+
+class RouteRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    def make_route(self, redis_client):
+        limiter = RouteRateLimiter(redis_client, key_func=lambda r: r.client.host)
+
+        @limiter.limit("2/minute")
+        async def route(request):
+            return "ok"
+        return route
+
+    async def test_rejects_calls_over_the_limit_per_client(self):
+        redis_client = FakeRedis()
+        route = self.make_route(redis_client)
+        self.assertEqual(await route(request=request("1.1.1.1")), "ok")
+        self.assertEqual(await route(request=request("1.1.1.1")), "ok")
+        with self.assertRaises(RateLimitExceeded) as raised:
+            await route(request=request("1.1.1.1"))
+        self.assertEqual(raised.exception.retry_after, 60)
+        self.assertEqual(await route(request=request("2.2.2.2")), "ok")
+        self.assertEqual(sorted(redis_client.hits.values()), [1, 3])
+
+    async def test_counts_in_memory_while_redis_is_down(self):
+        route = self.make_route(FakeRedis(down=True))
+        with self.assertLogs("rate_limiter", "WARNING"):
+            await route(request=request("1.1.1.1"))
+            await route(request=request("1.1.1.1"))
+            with self.assertRaises(RateLimitExceeded):
+                await route(request=request("1.1.1.1"))
+
+if __name__ == "__main__":
+    unittest.main()